@@ -1,9 +1,21 @@
+import sys
 import argparse
+from pathlib import Path
 
 from quickdot.core.config import Config
-from quickdot.core.watcher import Watcher
-from quickdot.core.generate import Generator
-from quickdot.core.trans import TranslationManager
+
+# The other modules are imported by the code paths that need them,
+# so that short builds don't pay for importing the watcher and server
+
+def parse_shard(value):
+    """Parses the i/n value of --shard."""
+    try:
+        index, count = map(int, value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected i/n like 1/4")
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', i must be between 1 and n")
+    return index, count
 
 def parse_args():
     """Parses the command line arguments."""
@@ -13,8 +25,32 @@ def parse_args():
                         help="Whether to use threads for processing")
     parser.add_argument("--thread-count", type=int, default=None, 
                         help="The number of threads to use if --use-threads is specified")
+    parser.add_argument("--executor", choices=['thread', 'process'], default=None,
+                        help="Whether to render in a pool of threads or of processes")
     parser.add_argument("--gather-texts", action='store_true', 
                         help="Whether to gather texts for translation")
+    parser.add_argument("--full-rebuild", action='store_true',
+                        help="Whether to ignore the build manifest and render every element")
+    parser.add_argument("--only-lang", type=str, nargs='+', default=None,
+                        help="Build only the languages matching these glob patterns")
+    parser.add_argument("--only-element", type=str, nargs='+', default=None,
+                        help="Build only the elements matching these glob patterns, like 'about' or 'posts/2023-*'")
+    parser.add_argument("--shard", type=parse_shard, default=None,
+                        help="Build only the i-th of n parts of the site, like 1/4; the first one also does the shared work")
+    parser.add_argument("--bytecode-cache", action='store_true', default=None,
+                        help="Whether to cache compiled templates on disk between builds")
+    parser.add_argument("--static-link", action='store_true', default=None,
+                        help="Whether to reflink or hardlink static files into the output instead of copying them")
+    parser.add_argument("--assets", action='store_true', default=None,
+                        help="Whether to fingerprint static files, minify the output and pre-compress it")
+    parser.add_argument("--dedup-languages", action='store_true', default=None,
+                        help="Whether to reuse the output of a language for the languages it reads the same translations in")
+    parser.add_argument("--profile", action='store_true',
+                        help="Whether to measure the build phases and report the slowest renders")
+    parser.add_argument("--profile-top", type=int, default=None,
+                        help="The number of slowest renders reported if --profile is specified")
+    parser.add_argument("--profile-output", type=str, default=None,
+                        help="Where to write the JSON report if --profile is specified")
     parser.add_argument("--run-watcher", action='store_true', 
                         help="Whether to run a file watcher for live updates")
     parser.add_argument("--site-output-path", type=str, default=None, 
@@ -22,22 +58,57 @@ def parse_args():
     parser.add_argument("--site-languages", type=str, nargs='+', default=None, 
                         help="The languages used on the site for internationalization")
 
+    subparsers = parser.add_subparsers(dest='command')
+    bench_parser = subparsers.add_parser('bench', help="Benchmark QuickDot against a synthetic site")
+    from quickdot.core import bench
+    bench.add_arguments(bench_parser)
+    serve_parser = subparsers.add_parser('serve-builds', help="Keep QuickDot warm and serve builds requested with `quickdot build`")
+    serve_parser.add_argument("--socket", type=str, default=None,
+                              help="The Unix socket to listen on, .quickdot/build.sock by default")
+    build_parser = subparsers.add_parser('build', help="Ask the `quickdot serve-builds` daemon for a build")
+    build_parser.add_argument("--socket", type=str, default=None,
+                              help="The Unix socket of the daemon, .quickdot/build.sock by default")
+    build_parser.add_argument("--full-rebuild", action='store_true', default=None,
+                              help="Whether to ignore the build manifest and render every element")
+    build_parser.add_argument("--gather-texts", action='store_true', default=None,
+                              help="Whether to gather texts for translation")
+
     args = parser.parse_args()
     return args
 
 def main():
     """Main entry point of the application."""
-    config = Config(parse_args())
-    trans = TranslationManager(config)
+    args = parse_args()
+    if args.command == 'bench':
+        from quickdot.core import bench
+        bench.run(args)
+        return
+    if args.command == 'build':
+        from quickdot.core import daemon
+        socket_path = Path(args.socket) if args.socket else None
+        ok = daemon.request_build(socket_path, full_rebuild=args.full_rebuild or None,
+                                  gather_texts=args.gather_texts or None)
+        sys.exit(0 if ok else 1)
+    if args.command == 'serve-builds':
+        from quickdot.core import daemon
+        socket_path = Path(args.socket) if args.socket else None
+        daemon.BuildDaemon(args, socket_path).serve()
+        return
+
+    from quickdot.core.trans import TranslationManager
 
-    if config.gather_texts:
-        trans.gather_texts()
+    config = Config(args)
+    trans = TranslationManager(config)
 
     if config.run_watcher:
+        if config.gather_texts:
+            trans.gather_texts()
+        from quickdot.core.watcher import Watcher
         watcher = Watcher(config, trans)
         watcher.watch()
     else:
-        Generator(config, trans).regenerate()
+        from quickdot.core.generate import Generator
+        Generator(config, trans).regenerate(gather_texts=config.gather_texts)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,254 @@
+import os
+import re
+import gzip
+import json
+import hashlib
+import logging
+import threading
+from pathlib import PurePosixPath
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Files worth compressing, the others are usually compressed already
+COMPRESSIBLE = {'.html', '.css', '.js', '.mjs', '.json', '.svg', '.xml', '.txt', '.map', '.ico'}
+# The suffixes of the pre-compressed siblings of a file
+COMPRESSED_SUFFIXES = ('.gz', '.br')
+# Content that whitespace is significant in
+RAW_HTML_TAGS = re.compile(r'(<(pre|textarea|script|style)\b[^>]*>.*?</\2\s*>)', re.S | re.I)
+HTML_COMMENT = re.compile(r'<!--(?!\[if|\s*\[endif).*?-->', re.S)
+CSS_STRING_OR_COMMENT = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.S)
+CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+
+
+def _collapse_whitespace(match):
+    return '\n' if '\n' in match.group(0) else ' '
+
+
+def minify_css(css):
+    """Removes the comments and the whitespace that doesn't change the
+    meaning of the stylesheet, leaving the strings untouched."""
+    parts = []
+    position = 0
+    for match in CSS_STRING_OR_COMMENT.finditer(css):
+        parts.append(_minify_css_code(css[position:match.start()]))
+        # Comments are dropped, strings kept as they are
+        if match.group(1) is not None:
+            parts.append(match.group(1))
+        position = match.end()
+    parts.append(_minify_css_code(css[position:]))
+    return ''.join(parts).strip()
+
+
+def _minify_css_code(code):
+    code = re.sub(r'\s+', ' ', code)
+    code = CSS_PUNCTUATION.sub(r'\1', code)
+    # The space before a colon is significant in selectors, the one after it never is
+    code = code.replace(': ', ':')
+    return code.replace(';}', '}')
+
+
+def minify_html(html):
+    """Removes the comments and collapses the whitespace of the page,
+    except inside pre, textarea, script and style elements. The
+    stylesheets of style elements are minified."""
+    parts = []
+    position = 0
+    for match in RAW_HTML_TAGS.finditer(html):
+        parts.append(_minify_html_code(html[position:match.start()]))
+        raw = match.group(1)
+        if match.group(2).lower() == 'style':
+            start = raw.index('>') + 1
+            end = raw.lower().rindex('</style')
+            raw = raw[:start] + minify_css(raw[start:end]) + raw[end:]
+        parts.append(raw)
+        position = match.end()
+    parts.append(_minify_html_code(html[position:]))
+    return ''.join(parts)
+
+
+def _minify_html_code(code):
+    code = HTML_COMMENT.sub('', code)
+    return re.sub(r'\s+', _collapse_whitespace, code)
+
+
+class AssetPipeline:
+    """Post-processes the output when enabled: writes fingerprinted copies
+    of the static files next to the plain ones, minifies stylesheets and
+    pages and pre-compresses them. Static files are only processed again
+    when their content changes."""
+
+    # Bumped whenever the processing changes, so that the cached results are dropped
+    VERSION = 1
+
+    def __init__(self, config):
+        self.config = config
+        self.enabled = config.assets
+        self.logger = logging.getLogger(__name__)
+        self.source_path = self.config.ROOT_PATH / self.config.site_static_path
+        self.output_path = self.config.site_output_path / 'static'
+        self.cache_path = self.config.CACHE_PATH / 'assets.json'
+
+        # Maps the path of every static file to the path of its fingerprinted copy
+        self.urls = {}
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def url(self, path):
+        """Returns the URL of a static file, fingerprinted if the pipeline is enabled."""
+        path = path.lstrip('/')
+        return f'/static/{self.urls.get(path, path)}'
+
+    def outputs(self):
+        """Returns the paths of all files written by the pipeline to the
+        static output directory."""
+        outputs = set()
+        for output in self.urls.values():
+            outputs.add(output)
+            outputs.update(output + suffix for suffix in self._compressed_suffixes(output))
+        return outputs
+
+    def signature(self):
+        """Describes the fingerprints, which the rendered pages link to,
+        and whether the pages are minified."""
+        urls = '\n'.join(f'{path} {output}' for path, output in sorted(self.urls.items()))
+        return f'assets {self.enabled}\n{urls}'
+
+    def process(self):
+        """Processes the static files that changed since the last build.
+        Returns whether any fingerprint changed."""
+        if self.enabled is False:
+            return False
+        files = []
+        for dirpath, _, filenames in os.walk(self.source_path):
+            for filename in filenames:
+                files.append(PurePosixPath(os.path.relpath(os.path.join(dirpath, filename), self.source_path)).as_posix())
+
+        with ThreadPoolExecutor(max_workers=self.config.thread_count) as executor:
+            results = list(executor.map(self._process_file, sorted(files)))
+        entries = {path: entry for path, entry, _ in results}
+        processed = sum(1 for _, _, was_processed in results if was_processed)
+
+        urls = {path: entry['output'] for path, entry in entries.items()}
+        changed = urls != self.urls
+        self._entries, self.urls = entries, urls
+        self._save()
+        self.logger.info(f'Processed assets: {processed} processed, {len(files) - processed} cached.')
+        return changed
+
+    def process_page(self, relpath, content):
+        """Minifies a rendered page."""
+        if self.enabled and relpath.endswith('.html'):
+            return minify_html(content)
+        return content
+
+    def compress(self, path, data, only_missing=False):
+        """Writes the pre-compressed siblings of an output file. When the
+        pipeline is disabled, removes the ones written by earlier builds,
+        which servers would keep serving in place of the file."""
+        if self.enabled is False:
+            self.remove_compressed(path)
+            return
+        suffixes = self._compressed_suffixes(path.name)
+        for suffix in suffixes:
+            compressed_path = path.with_name(path.name + suffix)
+            if only_missing and compressed_path.exists():
+                continue
+            self._write(compressed_path, self._compress(suffix, data))
+        # Brotli may have been installed when an earlier build ran
+        self.remove_compressed(path, keep=suffixes)
+
+    def compressed_paths(self, path):
+        return [path.with_name(path.name + suffix) for suffix in self._compressed_suffixes(path.name)]
+
+    @staticmethod
+    def remove_compressed(path, keep=()):
+        """Removes the pre-compressed siblings of an output file."""
+        if os.path.splitext(path.name)[1].lower() not in COMPRESSIBLE:
+            return
+        for suffix in COMPRESSED_SUFFIXES:
+            if suffix not in keep:
+                try:
+                    os.remove(path.with_name(path.name + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def _process_file(self, relpath):
+        """Returns the cache entry of a static file and whether it had to be processed."""
+        src = self.source_path / relpath
+        stat = os.stat(src)
+        with self._lock:
+            entry = self._entries.get(relpath)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+            with open(src, 'rb') as f:
+                data = f.read()
+            input_hash = hashlib.sha256(data + f'\0{self.VERSION}'.encode('utf-8')).hexdigest()
+        else:
+            data = None
+            input_hash = entry['hash']
+
+        if entry is not None and entry['hash'] == input_hash and self._has_outputs(entry['output']):
+            entry = dict(entry, size=stat.st_size, mtime=stat.st_mtime_ns)
+            return relpath, entry, False
+
+        if data is None:
+            with open(src, 'rb') as f:
+                data = f.read()
+        path = PurePosixPath(relpath)
+        output = str(path.with_name(f'{path.stem}.{input_hash[:12]}{path.suffix}'))
+        if path.suffix == '.css':
+            data = minify_css(data.decode('utf-8')).encode('utf-8')
+        output_path = self.output_path / output
+        self._write(output_path, data)
+        self.compress(output_path, data)
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': input_hash, 'output': output}
+        return relpath, entry, True
+
+    def _has_outputs(self, output):
+        output_path = self.output_path / output
+        return output_path.exists() and all(p.exists() for p in self.compressed_paths(output_path))
+
+    @staticmethod
+    def _compressed_suffixes(name):
+        if os.path.splitext(name)[1].lower() not in COMPRESSIBLE:
+            return []
+        return list(COMPRESSED_SUFFIXES) if brotli is not None else ['.gz']
+
+    @staticmethod
+    def _compress(suffix, data):
+        if suffix == '.br':
+            return brotli.compress(data)
+        # No timestamp, so that unchanged files compress to the same bytes
+        return gzip.compress(data, compresslevel=9, mtime=0)
+
+    @staticmethod
+    def _write(path, data):
+        os.makedirs(path.parent, exist_ok=True)
+        tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _load(self):
+        """Loads the fingerprints of the previous build."""
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        if data.get('version') != self.VERSION or self.enabled is False:
+            return
+        self._entries = data.get('files', {})
+        self.urls = {path: entry['output'] for path, entry in self._entries.items()}
+
+    def _save(self):
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'files': self._entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.cache_path)
@@ -0,0 +1,310 @@
+import os
+import sys
+import json
+import logging
+from pathlib import Path
+from datetime import date, timedelta
+
+# The modules only needed to run the benchmark are imported when it runs,
+# every build imports this module to add the bench subcommand's options
+
+
+class SyntheticSite:
+    """Writes a generated QuickDot project of the given size."""
+
+    # Languages have to be known to Babel to format the dates
+    LANGUAGES = ['en', 'de', 'fr', 'es', 'it', 'pl', 'pt', 'nl', 'sv', 'cs', 'da', 'fi', 'hu', 'ja', 'ko', 'tr']
+
+    def __init__(self, path, pages=20, posts=200, languages=3, po_entries=500,
+                 static_files=50, static_size=64 * 1024, template_depth=3, seed=0):
+        import random
+
+        self.path = Path(path)
+        self.pages = [f'page_{i}' for i in range(pages)]
+        self.posts = [f'post_{i}' for i in range(posts)]
+        self.languages = self.LANGUAGES[:languages]
+        self.po_entries = po_entries
+        self.static_files = static_files
+        self.static_size = static_size
+        self.template_depth = max(1, template_depth)
+        self.random = random.Random(seed)
+
+    def write(self):
+        """Writes the whole project to the path."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._write_json('config.json', {
+            'use_threads': True,
+            'thread_count': os.cpu_count() or 1,
+            'ignored_paths': ['.git', 'output'],
+            'ignored_files': [],
+            'timezone': 'UTC',
+            'live_server_port': 8000,
+        })
+        self._write_json('site.config.json', {
+            'site_name': 'Benchmark',
+            'site_url': 'https://example.com',
+            'version': 1,
+            'site_description': 'A synthetic QuickDot site',
+            'site_author': 'QuickDot',
+            'site_keywords': 'benchmark',
+            'site_author_email': 'bench@example.com',
+            'site_index_page': self.pages[0] if self.pages else '',
+            'site_blog_page': self.pages[0] if self.pages else '',
+            'site_pages': self.pages,
+            'site_posts': self.posts,
+            'site_static_path': 'static',
+            'site_output_path': 'output',
+            'site_languages': self.languages,
+            'site_translation_path': 'translations',
+        })
+        self._write_templates()
+        self._write_elements('pages', self.pages, 0)
+        self._write_elements('posts', self.posts, len(self.pages))
+        self._write_translations()
+        self._write_static()
+
+    def edit_post(self, index=0):
+        """Changes the context of a single post."""
+        name = self.posts[index]
+        self._write_json(f'posts/{name}/context.json', {'title': f'{name} {self.random.random()}'})
+
+    def _keys(self, index, count=5):
+        """Returns the keys used by the element, the ones that don't
+        wrap around being owned by its string table."""
+        if self.po_entries == 0:
+            return [], []
+        numbers = [index * count + i for i in range(count)]
+        keys = [f'KEY_{n % self.po_entries}' for n in numbers]
+        owned = [f'KEY_{n}' for n in numbers if n < self.po_entries]
+        return keys, owned
+
+    def _write_templates(self):
+        nav = (
+            '<nav>{% for name, element in _SITE_MAP.elements.items() %}'
+            '<a href="{{ element | get_url }}"{% if element is active %} class="active"{% endif %}>'
+            '{{ element | get_element_name }}</a>{% endfor %}</nav>'
+        )
+        self._write_text('templates/base_0.html', (
+            '<!DOCTYPE html>\n<html lang="{{ _LANG }}"><head><title>{{ title }}</title>'
+            '<link rel="stylesheet" href="/static/css/site.css"></head><body>\n'
+            f'{nav}\n{{% block content %}}{{% endblock %}}\n'
+            '<footer>{{ "KEY_0" | get_ttext }} {{ _DATE }}</footer></body></html>\n'
+        ))
+        for depth in range(1, self.template_depth):
+            self._write_text(f'templates/base_{depth}.html', (
+                f'{{% extends "base_{depth - 1}.html" %}}{{% block content %}}'
+                f'<div class="level-{depth}">{{% block level_{depth} %}}{{% endblock %}}</div>{{% endblock %}}\n'
+            ))
+
+    def _write_elements(self, element_type, names, offset):
+        layout = f'base_{self.template_depth - 1}.html'
+        block = f'level_{self.template_depth - 1}' if self.template_depth > 1 else 'content'
+        start = date(2020, 1, 1)
+        for index, name in enumerate(names):
+            keys, owned = self._keys(offset + index)
+            body = ''.join(f'<p>{{{{ "{key}" | get_ttext }}}}</p>' for key in keys)
+            if element_type == 'posts':
+                body += '<time>{{ _DATE_CREATED }}</time>'
+                postinfo = {'date': str(start + timedelta(days=index))}
+                self._write_json(f'posts/{name}/.postinfo.json', postinfo)
+            paragraphs = ''.join(f'<p>Lorem ipsum {self.random.random()}</p>' for _ in range(20))
+            self._write_text(f'{element_type}/{name}/{element_type[:-1]}.html', (
+                f'{{% extends "{layout}" %}}{{% block {block} %}}'
+                f'<h1>{{{{ title }}}}</h1>{body}{paragraphs}{{% endblock %}}\n'
+            ))
+            self._write_json(f'{element_type}/{name}/context.json', {'title': name})
+            # One key per element is not translated yet, for --gather-texts to add
+            string_table = [{'KEY': key, 'VALUE': f'Text of {key}'} for key in owned]
+            string_table.append({'KEY': f'TITLE_{name}', 'VALUE': name})
+            self._write_json(f'{element_type}/{name}/string_table.json', string_table)
+
+    def _write_translations(self):
+        for lang in self.languages:
+            entries = ''.join(
+                f'\nmsgid "KEY_{i}"\nmsgstr "{lang} text {i}"\n' for i in range(self.po_entries)
+            )
+            self._write_text(f'translations/texts_{lang}.po', f'#\nmsgid ""\nmsgstr ""\n{entries}')
+
+    def _write_static(self):
+        for i in range(self.static_files):
+            path = self.path / 'static' / f'dir_{i % 10}' / f'file_{i}.bin'
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(self.random.randbytes(self.static_size))
+        self._write_text('static/css/site.css', 'body { margin: 0 auto; }\n')
+
+    def _write_text(self, relpath, text):
+        path = self.path / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding='utf-8')
+
+    def _write_json(self, relpath, data):
+        self._write_text(relpath, json.dumps(data, indent=4))
+
+
+class Benchmark:
+    """Runs QuickDot against a synthetic site and reports how fast it is."""
+
+    SCENARIOS = ('full', 'noop', 'edit', 'gather', 'startup')
+
+    def __init__(self, args):
+        self.args = args
+        self.logger = logging.getLogger(__name__)
+        self.results = []
+
+    def run(self):
+        import tempfile
+
+        with tempfile.TemporaryDirectory(prefix='quickdot-bench-') as tmp:
+            site = SyntheticSite(
+                tmp, pages=self.args.pages, posts=self.args.posts, languages=self.args.languages,
+                po_entries=self.args.po_entries, static_files=self.args.static_files,
+                static_size=self.args.static_size, template_depth=self.args.template_depth,
+            )
+            site.write()
+            for executor in self.args.executors:
+                for scenario in self.args.scenarios:
+                    runs = [self._run_scenario(site, scenario, executor) for _ in range(self.args.repeat)]
+                    self.results.append(self._summarize(scenario, executor, runs))
+        self._report()
+        self._check_startup()
+
+    def _run_scenario(self, site, scenario, executor):
+        extra = []
+        if scenario == 'full':
+            extra = ['--full-rebuild']
+        elif scenario == 'edit':
+            site.edit_post()
+        elif scenario == 'gather':
+            extra = ['--gather-texts']
+        elif scenario == 'startup':
+            return self._run_startup(site.path, ['--executor', executor])
+        return self._run_quickdot(site.path, ['--executor', executor, *extra])
+
+    def _run_quickdot(self, path, args):
+        """Runs QuickDot in a child process, returning its wall time and
+        peak RSS along with the profile it wrote."""
+        profile_path = Path(path) / '.quickdot' / 'bench-profile.json'
+        _, rusage = self._spawn(path, ['--profile', '--profile-output', str(profile_path), *args])
+        with open(profile_path, 'r', encoding='utf-8') as f:
+            profile = json.load(f)
+        return {
+            'wall': profile['total']['wall'],
+            'renders': len(profile['renders']),
+            # kilobytes on Linux
+            'peak_rss_mb': rusage.ru_maxrss / 1024,
+            'phases': {name: times['wall'] for name, times in profile['phases'].items()},
+        }
+
+    def _run_startup(self, path, args, top=5):
+        """Runs an incremental build with nothing to do under -X importtime,
+        returning the time spent importing modules as its wall time and the
+        modules that took the longest to import as its phases."""
+        stderr, rusage = self._spawn(path, args, python_args=['-X', 'importtime'])
+        imports = {}
+        for line in stderr.splitlines():
+            if not line.startswith('import time:'):
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            name = name[1:]
+            # Nested imports are indented and already part of the cumulative time of their importer
+            if cumulative.strip().isdigit() and not name.startswith(' '):
+                imports[name] = imports.get(name, 0) + int(cumulative) / 1e6
+        slowest = sorted(imports.items(), key=lambda item: item[1], reverse=True)[:top]
+        return {
+            'wall': sum(imports.values()),
+            'renders': 0,
+            'peak_rss_mb': rusage.ru_maxrss / 1024,
+            'phases': {f'import {name}': seconds for name, seconds in slowest},
+        }
+
+    def _spawn(self, path, args, python_args=()):
+        """Runs QuickDot in a child process, returning its stderr and resource usage."""
+        import tempfile
+        import subprocess
+
+        command = [
+            sys.executable, *python_args, '-m', 'quickdot', '--use-threads', '--thread-count', str(self.args.workers), *args,
+        ]
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(command, cwd=path, stdout=subprocess.DEVNULL, stderr=stderr,
+                                       env=self._child_env())
+            _, status, rusage = os.wait4(process.pid, 0)
+            process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+            stderr.seek(0)
+            output = stderr.read().decode(errors='replace')
+        if process.returncode != 0:
+            raise RuntimeError(f'{" ".join(command)} failed:\n{output}')
+        return output, rusage
+
+    def _check_startup(self):
+        """Fails the benchmark if importing took longer than allowed."""
+        if self.args.max_import_time is None:
+            return
+        for result in self.results:
+            if result['scenario'] == 'startup' and result['wall'] * 1000 > self.args.max_import_time:
+                raise SystemExit(
+                    f'Importing took {result["wall"] * 1000:.0f}ms with the {result["executor"]} executor, '
+                    f'more than the allowed {self.args.max_import_time:.0f}ms.'
+                )
+
+    @staticmethod
+    def _child_env():
+        # Make sure the child imports the same QuickDot as the benchmark
+        env = dict(os.environ)
+        package_root = str(Path(__file__).resolve().parents[2])
+        env['PYTHONPATH'] = os.pathsep.join(p for p in (package_root, env.get('PYTHONPATH')) if p)
+        return env
+
+    @staticmethod
+    def _summarize(scenario, executor, runs):
+        import statistics
+
+        wall = statistics.median(run['wall'] for run in runs)
+        renders = runs[0]['renders']
+        phases = {name: statistics.median(run['phases'].get(name, 0.0) for run in runs) for name in runs[0]['phases']}
+        return {
+            'scenario': scenario,
+            'executor': executor,
+            'wall': wall,
+            'renders': renders,
+            'renders_per_second': renders / wall if wall else 0.0,
+            'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+            'phases': phases,
+        }
+
+    def _report(self):
+        print(f'{"scenario":<10} {"executor":<9} {"wall [s]":>9} {"renders":>8} {"renders/s":>10} {"peak RSS [MB]":>14}')
+        for result in self.results:
+            print(
+                f'{result["scenario"]:<10} {result["executor"]:<9} {result["wall"]:9.3f} {result["renders"]:8d} '
+                f'{result["renders_per_second"]:10.1f} {result["peak_rss_mb"]:14.1f}'
+            )
+            print('    ' + ', '.join(f'{name} {wall:.3f}s' for name, wall in result['phases'].items()))
+        if self.args.output:
+            with open(self.args.output, 'w', encoding='utf-8') as f:
+                json.dump({'options': vars(self.args), 'results': self.results}, f, indent=2)
+
+
+def add_arguments(parser):
+    """Adds the benchmark options to the given argument parser."""
+    parser.add_argument("--pages", type=int, default=20, help="The number of pages of the synthetic site")
+    parser.add_argument("--posts", type=int, default=200, help="The number of posts of the synthetic site")
+    parser.add_argument("--languages", type=int, default=3, help="The number of languages of the synthetic site")
+    parser.add_argument("--po-entries", type=int, default=500, help="The number of entries of every .po file")
+    parser.add_argument("--static-files", type=int, default=50, help="The number of static files")
+    parser.add_argument("--static-size", type=int, default=64 * 1024, help="The size of every static file in bytes")
+    parser.add_argument("--template-depth", type=int, default=3, help="The depth of template inheritance")
+    parser.add_argument("--executors", nargs='+', choices=['thread', 'process'], default=['thread', 'process'],
+                        help="The rendering backends to compare")
+    parser.add_argument("--scenarios", nargs='+', choices=Benchmark.SCENARIOS, default=list(Benchmark.SCENARIOS),
+                        help="The builds to measure")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="The number of threads or processes used for rendering")
+    parser.add_argument("--repeat", type=int, default=3, help="How many times every scenario is run")
+    parser.add_argument("--output", type=str, default=None, help="Where to write the JSON results")
+    parser.add_argument("--max-import-time", type=float, default=None,
+                        help="Fail if the startup scenario spends more milliseconds importing modules")
+
+
+def run(args):
+    Benchmark(args).run()
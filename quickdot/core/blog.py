@@ -0,0 +1,188 @@
+import re
+import hashlib
+from html import escape
+from datetime import date as datetime_date
+from datetime import datetime as datetime_time
+
+
+def slugify(tag):
+    """Returns the part of the URL of a tag's listing."""
+    return re.sub(r'[^\w-]+', '-', tag.lower()).strip('-') or 'tag'
+
+
+def unique_slugs(tags):
+    """Returns the slug of every tag, telling apart the tags that slugify
+    to the same one, like C++ and C#, with a hash of the tag. A tag that
+    already is its slug keeps it, so its URL doesn't change."""
+    groups = {}
+    for tag in tags:
+        groups.setdefault(slugify(tag), []).append(tag)
+    slugs = {}
+    for slug, group in groups.items():
+        for tag in group:
+            if len(group) == 1 or tag == slug:
+                slugs[tag] = slug
+            else:
+                slugs[tag] = f'{slug}-{hashlib.sha1(tag.encode("utf-8")).hexdigest()[:8]}'
+    return slugs
+
+
+class ListingPage:
+    """A page of a blog listing in a language, exposed to the listing
+    template as _LISTING."""
+
+    def __init__(self, lang, tag, number, count, posts, slug=None):
+        self.lang = lang
+        self.tag = tag
+        self.number = number
+        self.count = count
+        self.posts = posts
+        # The part of the URL of the tag's listing
+        self.slug = slug
+
+    @property
+    def path(self):
+        """The path of the page relative to the output directory."""
+        return self.page_path(self.number)
+
+    @property
+    def url(self):
+        return f'/{self.path}'
+
+    @property
+    def prev_url(self):
+        return f'/{self.page_path(self.number - 1)}' if self.number > 1 else None
+
+    @property
+    def next_url(self):
+        return f'/{self.page_path(self.number + 1)}' if self.number < self.count else None
+
+    def page_path(self, number):
+        base = f'{self.lang}/blog' if self.tag is None else f'{self.lang}/blog/tags/{self.slug}'
+        return f'{base}/index.html' if number == 1 else f'{base}/{number}.html'
+
+
+class PostIndex:
+    """The posts sorted by date, newest first, with the posts of every tag,
+    built once per build from the post metadata."""
+
+    def __init__(self, posts):
+        self.posts = sorted(posts, key=lambda post: (post.date, post.name), reverse=True)
+        tags = {}
+        for post in self.posts:
+            for tag in post.tags:
+                tags.setdefault(tag, []).append(post)
+        self.tags = dict(sorted(tags.items()))
+        self.slugs = unique_slugs(self.tags)
+
+    def __iter__(self):
+        return iter(self.posts)
+
+    def __len__(self):
+        return len(self.posts)
+
+    def listing(self, lang, per_page):
+        """Returns the pages listing all posts and the posts of every tag."""
+        pages = self._paginate(lang, None, self.posts, per_page)
+        for tag, posts in self.tags.items():
+            pages.extend(self._paginate(lang, tag, posts, per_page))
+        return pages
+
+    def tag_url(self, lang, tag):
+        """Returns the URL of the first page listing the posts of the tag."""
+        return f'/{lang}/blog/tags/{self.slugs[tag]}/index.html'
+
+    def _paginate(self, lang, tag, posts, per_page):
+        count = max(1, -(-len(posts) // per_page))
+        slug = None if tag is None else self.slugs[tag]
+        return [
+            ListingPage(lang, tag, number + 1, count, posts[number * per_page:(number + 1) * per_page], slug)
+            for number in range(count)
+        ]
+
+
+class FeedWriter:
+    """Writes the RSS and Atom feeds of every language and the sitemap,
+    every one of them in a single pass over the post index."""
+
+    def __init__(self, config, writer):
+        self.config = config
+        self.writer = writer
+        self.site_url = config.site_url.rstrip('/')
+
+    def write_feeds(self, index, lang, get_text):
+        posts = index.posts[:self.config.feed_size]
+        self.writer.write(f'{lang}/feed.xml', self._rss(posts, lang, get_text))
+        self.writer.write(f'{lang}/atom.xml', self._atom(posts, lang, get_text))
+
+    def write_sitemap(self, site_map, listings):
+        """Writes sitemap.xml with every element in every language and
+        the given listing pages."""
+        urls = []
+        for lang in self.config.site_languages:
+            for element in site_map.elements.values():
+                lastmod = getattr(element, 'date', None)
+                lastmod = f'<lastmod>{escape(lastmod)}</lastmod>' if lastmod else ''
+                urls.append(f'<url><loc>{escape(self._absolute(element.get_url(lang)))}</loc>{lastmod}</url>')
+        for page in listings:
+            urls.append(f'<url><loc>{escape(self._absolute(page.url))}</loc></url>')
+        self.writer.write('sitemap.xml', (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+            + ''.join(f'{url}\n' for url in urls)
+            + '</urlset>\n'
+        ))
+
+    def _rss(self, posts, lang, get_text):
+        from email.utils import format_datetime
+
+        items = []
+        for post in posts:
+            url = escape(self._absolute(post.get_url(lang)))
+            categories = ''.join(f'<category>{escape(tag)}</category>' for tag in post.tags)
+            items.append(
+                f'<item><title>{escape(get_text(post.name, lang))}</title><link>{url}</link>'
+                f'<guid>{url}</guid><pubDate>{format_datetime(self._datetime(post.date))}</pubDate>'
+                f'{self._summary("description", post, lang, get_text)}{categories}</item>\n'
+            )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0"><channel>\n'
+            f'<title>{escape(self.config.site_name)}</title><link>{escape(self.site_url)}/</link>'
+            f'<description>{escape(self.config.site_description)}</description><language>{escape(lang)}</language>\n'
+            + ''.join(items)
+            + '</channel></rss>\n'
+        )
+
+    def _atom(self, posts, lang, get_text):
+        feed_url = self._absolute(f'/{lang}/atom.xml')
+        updated = self._datetime(posts[0].date if posts else None).isoformat()
+        entries = []
+        for post in posts:
+            url = escape(self._absolute(post.get_url(lang)))
+            categories = ''.join(f'<category term="{escape(tag)}"/>' for tag in post.tags)
+            entries.append(
+                f'<entry><title>{escape(get_text(post.name, lang))}</title><link href="{url}"/>'
+                f'<id>{url}</id><updated>{self._datetime(post.date).isoformat()}</updated>'
+                f'{self._summary("summary", post, lang, get_text)}{categories}</entry>\n'
+            )
+        return (
+            f'<?xml version="1.0" encoding="UTF-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom" xml:lang="{escape(lang)}">\n'
+            f'<title>{escape(self.config.site_name)}</title><link href="{escape(self.site_url)}/"/>'
+            f'<link rel="self" href="{escape(feed_url)}"/><id>{escape(feed_url)}</id><updated>{updated}</updated>'
+            f'<author><name>{escape(self.config.site_author)}</name></author>\n'
+            + ''.join(entries)
+            + '</feed>\n'
+        )
+
+    @staticmethod
+    def _summary(tag, post, lang, get_text):
+        if not post.summary:
+            return ''
+        return f'<{tag}>{escape(get_text(post.summary, lang))}</{tag}>'
+
+    def _absolute(self, url):
+        return f'{self.site_url}{url}'
+
+    def _datetime(self, date):
+        date = datetime_date.today() if date is None else datetime_date.fromisoformat(date)
+        return self.config.timezone.localize(datetime_time(date.year, date.month, date.day))
@@ -8,6 +8,8 @@ import pytz
 class Config:
     # The root path of the project
     ROOT_PATH = Path(os.getcwd())
+    # Where the caches kept between builds are stored
+    CACHE_PATH = ROOT_PATH / '.quickdot'
 
     """Class responsible for both generator config handling
     as well as sites config handling."""
@@ -30,6 +32,8 @@ class Config:
                 # used for site generation
                 self.use_threads = config_data["use_threads"]
                 self.thread_count = config_data["thread_count"]
+                # either 'thread' or 'process'
+                self.executor = config_data.get("executor", "thread")
 
                 self.ignored_paths = [self.ROOT_PATH / p for p in config_data["ignored_paths"]]
                 self.ignored_files = config_data['ignored_files']
@@ -37,8 +41,28 @@ class Config:
                 self.timezone = pytz.timezone(config_data["timezone"])
 
                 self.gather_texts = False
+                self.full_rebuild = False
+                # used for partial builds, None meaning everything
+                self.only_langs = None
+                self.only_elements = None
+                # the 1-based index of the shard and the number of shards
+                self.shard = None
+                self.bytecode_cache = config_data.get("bytecode_cache", False)
+                self.static_link = config_data.get("static_link", False)
+                self.assets = config_data.get("assets", False)
+                self.dedup_languages = config_data.get("dedup_languages", False)
+                # used for the blog listings and the feeds
+                self.posts_per_page = config_data.get("posts_per_page", 10)
+                self.feed_size = config_data.get("feed_size", 20)
+
+                # used for build profiling
+                self.profile = False
+                self.profile_top = 10
+                self.profile_output = self.CACHE_PATH / 'profile.json'
 
                 self.live_server_port = config_data["live_server_port"]
+                # seconds to wait for more file events before rebuilding
+                self.watcher_debounce = config_data.get("watcher_debounce", 0.3)
         except FileNotFoundError:
             print("No config file found.")
         except json.JSONDecodeError or KeyError:
@@ -81,8 +105,32 @@ class Config:
             self.use_threads = args.use_threads
         if args.thread_count is not None:
             self.thread_count = args.thread_count
+        if args.executor is not None:
+            self.executor = args.executor
         if args.gather_texts is not None:
             self.gather_texts = args.gather_texts
+        if args.full_rebuild is not None:
+            self.full_rebuild = args.full_rebuild
+        if args.only_lang is not None:
+            self.only_langs = args.only_lang
+        if args.only_element is not None:
+            self.only_elements = args.only_element
+        if args.shard is not None:
+            self.shard = args.shard
+        if args.bytecode_cache is not None:
+            self.bytecode_cache = args.bytecode_cache
+        if args.static_link is not None:
+            self.static_link = args.static_link
+        if args.assets is not None:
+            self.assets = args.assets
+        if args.dedup_languages is not None:
+            self.dedup_languages = args.dedup_languages
+        if args.profile is not None:
+            self.profile = args.profile
+        if args.profile_top is not None:
+            self.profile_top = args.profile_top
+        if args.profile_output is not None:
+            self.profile_output = Path(args.profile_output)
         if args.run_watcher is not None:
             self.run_watcher = args.run_watcher
         if args.site_output_path is not None:
@@ -90,20 +138,19 @@ class Config:
         if args.site_languages is not None:
             self.site_languages = args.site_languages
     
+    def next_build(self):
+        """Counts a new build of a long running process, like the build daemon."""
+        self._handle_build_number()
+
     def _handle_build_number(self):
-        """Handles the build number."""
+        """Handles the build number, reading .buildinfo once and writing it once."""
         try:
-            with open(self.ROOT_PATH / ".buildinfo", "r+") as f:
+            with open(self.ROOT_PATH / ".buildinfo", "r") as f:
                 self.build_number, self.prev_version = map(int, f.read().strip().split(' '))
-                f.write(f'{self.build_number + 1} {self.version}')
-        except FileNotFoundError:
+        except (FileNotFoundError, ValueError):
             self.build_number = 0
             self.prev_version = self.version
-        except ValueError as e:
+        if self.version != self.prev_version:
             self.build_number = 0
-            self.prev_version = self.version
-        finally:
-            if self.version != self.prev_version:
-                self.build_number = 0
-            with open(self.ROOT_PATH / ".buildinfo", "w+") as f:
-                f.write(f'{self.build_number + 1} {self.version}')
+        with open(self.ROOT_PATH / ".buildinfo", "w") as f:
+            f.write(f'{self.build_number + 1} {self.version}')
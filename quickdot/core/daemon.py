@@ -0,0 +1,208 @@
+import os
+import json
+import socket
+import signal
+import logging
+import threading
+import socketserver
+from time import perf_counter
+
+from quickdot.core.config import Config
+
+# Options of a build request, the others are fixed when the daemon starts
+REQUEST_OPTIONS = ('full_rebuild', 'gather_texts')
+
+
+def default_socket_path():
+    return Config.CACHE_PATH / 'build.sock'
+
+
+class _ConnectionLogHandler(logging.Handler):
+    """Sends the log records of a build to the client that requested it."""
+
+    def __init__(self, send):
+        super().__init__()
+        self.send = send
+        self.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+
+    def emit(self, record):
+        try:
+            self.send({'log': self.format(record), 'level': record.levelno})
+        except OSError:
+            # The client went away, the build goes on
+            pass
+
+
+class BuildRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        # Connections without a request only check whether the daemon runs
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+        except ValueError:
+            self._send({'done': True, 'ok': False, 'error': 'Invalid request.'})
+            return
+        handler = _ConnectionLogHandler(self._send)
+        ok, error = self.server.daemon.build(request, handler)
+        self._send({'done': True, 'ok': ok, 'error': error})
+
+    def _send(self, message):
+        self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+
+class BuildServer(socketserver.UnixStreamServer):
+    """Accepts build requests on a Unix socket, one at a time."""
+
+    def __init__(self, path, daemon):
+        self.daemon = daemon
+        super().__init__(str(path), BuildRequestHandler)
+
+
+class BuildDaemon:
+    """Keeps the config, the translations, the Jinja environment and the
+    compiled templates in memory between builds. Before every build it
+    checks which inputs changed and drops only the state they affect:
+    changed config files reload everything, changed .po files reload
+    their language, and Jinja recompiles the templates whose files
+    changed. The rest is left to the build manifest. The process pool of
+    the generator is kept too, its workers refresh their state the same way."""
+
+    def __init__(self, args, socket_path=None):
+        self.args = args
+        self.socket_path = default_socket_path() if socket_path is None else socket_path
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._config_stamps = None
+        self._manifest_stamp = None
+        self.generator = None
+        self._load()
+
+    def serve(self):
+        self._remove_stale_socket()
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        server = BuildServer(self.socket_path, self)
+        # Clean up the socket when stopped by a service manager too
+        signal.signal(signal.SIGTERM, self._terminate)
+        self.logger.info(f'Serving builds at {self.socket_path}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.socket_path.unlink(missing_ok=True)
+            self.generator.close()
+
+    @staticmethod
+    def _terminate(signum, frame):
+        raise KeyboardInterrupt
+
+    def build(self, request, log_handler):
+        """Runs a build requested by a client, sending it the build's log.
+        Returns whether the build succeeded and the error if it didn't."""
+        with self._lock:
+            root_logger = logging.getLogger()
+            root_logger.addHandler(log_handler)
+            start = perf_counter()
+            try:
+                self._refresh()
+                # A freshly loaded config has already counted its build
+                if self._build_counted:
+                    self._build_counted = False
+                else:
+                    self.config.next_build()
+                defaults = {name: getattr(self.config, name) for name in REQUEST_OPTIONS}
+                try:
+                    for name in REQUEST_OPTIONS:
+                        if request.get(name) is not None:
+                            setattr(self.config, name, bool(request[name]))
+                    self.generator.regenerate(gather_texts=self.config.gather_texts)
+                finally:
+                    for name, value in defaults.items():
+                        setattr(self.config, name, value)
+                self._manifest_stamp = self._stamp(self.generator.manifest.path)
+                self.logger.info(f'Build served in {perf_counter() - start:.2f}s.')
+                return True, None
+            except Exception as e:
+                self.logger.error(f'Build failed: {e}')
+                return False, str(e)
+            finally:
+                root_logger.removeHandler(log_handler)
+
+    def _load(self):
+        """Creates the whole state from scratch."""
+        from quickdot.core.trans import TranslationManager
+        from quickdot.core.generate import Generator
+
+        if self.generator is not None:
+            self.generator.close()
+        self.config = Config(self.args)
+        self._build_counted = True
+        self.trans = TranslationManager(self.config)
+        self.generator = Generator(self.config, self.trans)
+        self._config_stamps = self._config_file_stamps()
+        self._manifest_stamp = self._stamp(self.generator.manifest.path)
+
+    def _refresh(self):
+        """Drops the state that changed files affect."""
+        if self._config_file_stamps() != self._config_stamps:
+            self.logger.info('Configuration changed, reloading everything...')
+            self._load()
+            return
+
+        self.trans.drop_outdated()
+
+        # Builds run without the daemon may have changed the outputs
+        if self._stamp(self.generator.manifest.path) != self._manifest_stamp:
+            self.generator.manifest.load()
+
+    def _config_file_stamps(self):
+        return [self._stamp(self.config.ROOT_PATH / name) for name in ('config.json', 'site.config.json')]
+
+    @staticmethod
+    def _stamp(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _remove_stale_socket(self):
+        """Removes the socket left by a daemon that didn't exit cleanly,
+        refusing to start if another daemon is still serving on it."""
+        if not self.socket_path.exists():
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            try:
+                client.connect(str(self.socket_path))
+            except (ConnectionRefusedError, FileNotFoundError):
+                self.socket_path.unlink(missing_ok=True)
+                return
+        raise RuntimeError(f'Another daemon is already serving builds at {self.socket_path}.')
+
+
+def request_build(socket_path=None, **options):
+    """Asks the daemon for a build, printing its log as it arrives.
+    Returns whether the build succeeded."""
+    socket_path = default_socket_path() if socket_path is None else socket_path
+    request = {name: options.get(name) for name in REQUEST_OPTIONS}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(str(socket_path))
+        except (ConnectionRefusedError, FileNotFoundError):
+            print(f'No daemon is serving builds at {socket_path}, start one with `quickdot serve-builds`.')
+            return False
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with client.makefile('r', encoding='utf-8') as responses:
+            for line in responses:
+                response = json.loads(line)
+                if 'log' in response:
+                    print(response['log'])
+                elif response.get('done'):
+                    return response['ok']
+    print('The daemon closed the connection before the build finished.')
+    return False
@@ -0,0 +1,141 @@
+import logging
+import threading
+from time import perf_counter
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from quickdot.core.tracking import RenderRecord, recording, current_record, language_of
+
+
+class FragmentCache:
+    """Rendered template fragments, kept for the duration of a build."""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forgets the fragments and the statistics of the previous build."""
+        with self._lock:
+            self._fragments = {}
+            # Hits, misses and the time spent rendering the misses, per fragment name
+            self.stats = {}
+
+    def get_or_render(self, key, render):
+        """Returns the fragment, rendering it on a miss. What the fragment
+        read when it was rendered is added to the record of every render
+        using it, as if each of them had rendered it."""
+        parent = current_record()
+        with self._lock:
+            cached = self._fragments.get(key)
+            stats = self.stats.setdefault(key[0], [0, 0, 0.0])
+            if cached is not None:
+                stats[0] += 1
+        if cached is not None:
+            fragment, record = cached
+            if parent is not None:
+                parent.merge(record)
+            return fragment
+        # Renders of the same fragment running at the same time all miss,
+        # they produce the same output anyway
+        start = perf_counter()
+        with recording(RenderRecord()) as record:
+            fragment = render()
+        render_time = perf_counter() - start
+        if parent is not None:
+            parent.merge(record)
+        with self._lock:
+            self._fragments.setdefault(key, (fragment, record))
+            stats[1] += 1
+            stats[2] += render_time
+        return fragment
+
+    def pop_stats(self):
+        """Returns and forgets the statistics, used to send the ones of
+        worker processes to the main one."""
+        with self._lock:
+            stats, self.stats = self.stats, {}
+        return stats
+
+    def add_stats(self, stats):
+        with self._lock:
+            for name, (hits, misses, render_time) in stats.items():
+                totals = self.stats.setdefault(name, [0, 0, 0.0])
+                totals[0] += hits
+                totals[1] += misses
+                totals[2] += render_time
+
+    def summary(self):
+        """Returns the hit rate of every fragment and an estimate of the
+        render time saved by the hits."""
+        summary = {}
+        for name, (hits, misses, render_time) in sorted(self.stats.items()):
+            lookups = hits + misses
+            summary[name] = {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'render_time': render_time,
+                'saved_time': hits * render_time / misses if misses else 0.0,
+            }
+        return summary
+
+    def log_summary(self):
+        summary = self.summary()
+        if not summary:
+            return
+        hits = sum(fragment['hits'] for fragment in summary.values())
+        lookups = hits + sum(fragment['misses'] for fragment in summary.values())
+        saved_time = sum(fragment['saved_time'] for fragment in summary.values())
+        self.logger.info(
+            f'Fragment cache: {hits} of {lookups} lookups hit ({hits / lookups:.0%}), '
+            f'saving about {saved_time:.3f}s of rendering.'
+        )
+        for name, fragment in summary.items():
+            self.logger.debug(
+                '  %s: %d hits, %d misses, %.3fs rendering, %.3fs saved',
+                name, fragment['hits'], fragment['misses'], fragment['render_time'], fragment['saved_time'],
+            )
+
+
+class FragmentCacheExtension(Extension):
+    """Adds the {% cache name[, value...] %}...{% endcache %} tag, rendering
+    its body once per language and combination of the given values and
+    reusing it in every render of the build that asks for the same one.
+
+    The body must not depend on anything else, the active element included,
+    unless it is passed as one of the values:
+
+        {% cache "footer" %}...{% endcache %}
+        {% cache "nav", _ELEMENT.name %}...{% endcache %}
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=FragmentCache())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        values = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            values.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        args = [nodes.Name('_LANG', 'load'), nodes.List(values)]
+        return nodes.CallBlock(self.call_method('_render_fragment', args), [], [], body).set_lineno(lineno)
+
+    def _render_fragment(self, lang, values, caller):
+        name, *values = values
+        key = (str(name), language_of(lang), *(self._hashable(value) for value in values))
+        return self.environment.fragment_cache.get_or_render(key, caller)
+
+    @staticmethod
+    def _hashable(value):
+        try:
+            hash(value)
+        except TypeError:
+            return repr(value)
+        return value
@@ -1,31 +1,59 @@
 import os
 import json
-import shutil
+import math
+import pickle
+import hashlib
+import zlib
+import signal
 import logging
+import threading
 import traceback
+from time import perf_counter, thread_time
 from enum import Enum
 from pathlib import Path
+from fnmatch import fnmatchcase
+from typing import NamedTuple
+from contextvars import ContextVar
+from collections import ChainMap
+from types import MappingProxyType
 from datetime import date as datetime_date
 from datetime import datetime as datetime_time
 from concurrent.futures import ThreadPoolExecutor
 
-from jinja2 import Environment, FileSystemLoader
-from babel import Locale
-from babel.dates import format_date, format_time
+from jinja2 import (
+    Environment, FileSystemLoader, ChoiceLoader, PrefixLoader,
+    FileSystemBytecodeCache, meta, pass_context,
+)
+from markupsafe import Markup, escape
+
+from quickdot.core.manifest import BuildManifest
+from quickdot.core.static import StaticSync
+from quickdot.core.output import OutputWriter
+from quickdot.core.fragments import FragmentCacheExtension
+from quickdot.core.blog import PostIndex, FeedWriter
+from quickdot.core.assets import AssetPipeline
+from quickdot.core.profile import BuildProfiler
+from quickdot.core.tracking import (
+    LANG_PLACEHOLDER, NAV_KEY, RenderRecord, LanguageCode, LanguageLayer, ValuesLayer,
+    LayeredContext, LayeredTemplate, recording, record_text, language_of, with_real_codes,
+)
 
 
 class ElementType(Enum):
     PAGE = 0
     POST = 1
 
+# The element being rendered by the current thread
+_active_element = ContextVar('active_element', default=None)
+
 class Element:
     def __init__(self, type, name):
         self.type = type
         self.name = name
-        self.is_active = False
-    
-    def toggle_active(self):
-        self.is_active = not self.is_active
+
+    @property
+    def is_active(self):
+        return _active_element.get() is self
     
     def get_url(self, lang):
         return f'/{lang}/{"posts" if self.type == ElementType.POST else "pages"}/{self.name}.html'
@@ -38,41 +66,316 @@ class PageElement(Element):
         super().__init__(ElementType.PAGE, name)
 
 class PostElement(Element):
-    def __init__(self, name, date):
+    def __init__(self, name, date, tags=(), summary=None):
         super().__init__(ElementType.POST, name)
         self.date = date
+        self.tags = tags
+        # The translation key of the summary shown in the feeds
+        self.summary = summary
 
 class SiteMap:
     def __init__(self):
         self.elements = {}
+        self.posts = PostIndex([])
     
     def add_element(self, element):
         self.elements[element.name] = element
 
+    def language_nav(self, lang, texts):
+        """Builds the navigation table of a language, translating the
+        element names with the given texts."""
+        return LanguageNav(self, lang, texts)
+
+class NavEntry:
+    """An element as seen from the navigation of a language."""
+
+    __slots__ = ('element', 'name', 'type', 'url', 'title', 'prev', 'next', 'link', 'active_link')
+
+    def __init__(self, element, lang, texts):
+        self.element = element
+        self.name = element.name
+        self.type = 'posts' if element.type == ElementType.POST else 'pages'
+        self.url = element.get_url(lang)
+        self.title = texts.get(element.name, element.name)
+        # The previous and next element of the same type
+        self.prev = None
+        self.next = None
+        url, title = escape(self.url), escape(self.title)
+        self.link = f'<a href="{url}">{title}</a>'
+        self.active_link = f'<a href="{url}" class="active" aria-current="page">{title}</a>'
+
+class LanguageNav:
+    """The URLs, translated titles and prev/next links of all elements in
+    one language, built once per build and exposed to templates as _NAV."""
+
+    def __init__(self, site_map, lang, texts):
+        self.lang = lang
+        self.entries = {name: NavEntry(element, lang, texts) for name, element in site_map.elements.items()}
+        self.pages = [entry for entry in self.entries.values() if entry.type == 'pages']
+        self.posts = [entry for entry in self.entries.values() if entry.type == 'posts']
+        for entries in (self.pages, self.posts):
+            for prev, next in zip(entries, entries[1:]):
+                prev.next = next
+                next.prev = prev
+        self._links = [entry.link for entry in self.entries.values()]
+        self._menu = Markup(''.join(self._links))
+
+    def __getitem__(self, name):
+        return self.entries[name]
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def url(self, name):
+        return self.entries[name].url
+
+    def title(self, name):
+        return self.entries[name].title
+
+    def menu(self, active=None):
+        """Returns the links to all elements, marking the active one. The
+        links are rendered once per build, so a menu costs a single join."""
+        if active is None:
+            return self._menu
+        name = getattr(active, 'name', active)
+        if name not in self.entries:
+            return self._menu
+        return Markup(''.join(
+            entry.active_link if entry.name == name else link
+            for entry, link in zip(self.entries.values(), self._links)
+        ))
+
+class RenderTask(NamedTuple):
+    """A single render of an element in a language."""
+    element_type: str
+    element: str
+    lang: str
+    plan: tuple
+
+
+# The generator of a worker process, see Generator.for_worker, the build
+# it renders and the language contexts of that build
+_worker_generator = None
+_worker_build = None
+_worker_contexts = {}
+
+
+def _init_worker(config):
+    global _worker_generator
+    # Stopping the main process stops the pool, workers don't handle the
+    # signals themselves, nor inherit the handlers of the build daemon
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _worker_generator = Generator.for_worker(config)
+
+
+def _render_batch(build, groups, values):
+    """Renders batches of task groups in a worker process and returns the
+    render times, translations and values read and reuse of the tasks
+    rendered successfully, along with everything the worker's profiler,
+    output writer and fragment cache recorded. The first batch of a build
+    the worker gets starts the build, see Generator._begin_worker_build."""
+    global _worker_build
+    generator = _worker_generator
+    build_id, state = build
+    if build_id != _worker_build:
+        generator._begin_worker_build(*pickle.loads(state))
+        _worker_contexts.clear()
+        _worker_build = build_id
+    for lang in {task.lang for group in groups for task in group}:
+        if lang not in _worker_contexts:
+            _worker_contexts[lang] = generator._language_context(values[lang])
+    rendered = []
+    for group in groups:
+        rendered.extend(generator._render_group(group, _worker_contexts, values))
+    return (rendered, generator.profiler.pop(), generator.writer.pop_stats(),
+            generator.jinja_env.fragment_cache.pop_stats())
+
+
 class Generator:
+    # Bumped whenever the compiled templates change without their sources,
+    # so that the cached bytecode is dropped
+    BYTECODE_VERSION = 2
+
     def __init__(self, config, trans):
         self.logger = self._setup_logger()
         self.config = config
         self.trans = trans
+        # The Jinja environment exposes the fingerprinted asset URLs
+        self.assets = AssetPipeline(self.config)
         self.jinja_env = self._setup_jinja_env()
 
         self.site_map = SiteMap()
-        self.context = {'_SITE_MAP': self.site_map, '_CONFIG': self.config}
+        self.site_context = self._site_context()
+
+        self.manifest = BuildManifest(self.config)
+        self.profiler = BuildProfiler(self.config)
+        self.writer = OutputWriter(self.config, self.assets)
+        self.feeds = FeedWriter(self.config, self.writer)
+        self.static_sync = StaticSync(self.config)
+        self._template_deps = {}
+        self._signature = None
+        self._locales = {}
+        self._values = {}
+        self._titles = {}
+        self._thread_pool = None
+        # Kept between builds, so that the workers stay warm
+        self._process_pool = None
+        self._process_builds = 0
+        self._template_locks = {}
+        self._template_locks_lock = threading.Lock()
+
+    @classmethod
+    def for_worker(cls, config):
+        """Creates a generator rendering in a worker process. It renders
+        every build of the pool, see _begin_worker_build."""
+        from quickdot.core.trans import TranslationManager
+
+        return cls(config, TranslationManager(config))
+
+    def close(self):
+        """Stops the pools kept between builds."""
+        if self._process_pool is not None:
+            self._process_pool.shutdown()
+            self._process_pool = None
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown()
+            self._thread_pool = None
 
-    def regenerate(self):
-        self._copy_static_files()
-        self._gather_data()
+    def regenerate(self, gather_texts=False):
+        """Builds the whole site, gathering the texts for translation first
+        if asked to, so that the profile measures the gathering too."""
+        self._begin_build()
+        if gather_texts:
+            with self.profiler.phase('text gathering'):
+                self.trans.gather_texts()
+        with self.profiler.phase('static copy'):
+            self._copy_static_files()
+        with self.profiler.phase('gather data'):
+            self._gather_data()
         self._generate_site()
+        self._end_build()
+
+    def regenerate_elements(self, elements=None, languages=None):
+        """Renders only the given elements in the given languages,
+        None meaning all of them."""
+        self._begin_build()
+        with self.profiler.phase('gather data'):
+            self._gather_data()
+        self._generate_site(elements, languages)
+        self._end_build()
+
+    def copy_static_file(self, path):
+        """Copies a single file from the static directory to the output,
+        or removes it from the output if it was deleted. Returns whether
+        the fingerprinted URLs changed, so that pages need to be rendered again."""
+        self.static_sync.sync_file(path)
+        return self.assets.process()
+
+    def elements_using(self, path):
+        """Returns the names of elements whose outputs depend on the given
+        file, or None if no element is known to depend on it."""
+        keys = self.manifest.dependents(path)
+        names = {
+            Path(key).stem for key in keys
+            if len(Path(key).parts) == 3 and Path(key).parts[1] in ('pages', 'posts')
+        }
+        # Files only used by the blog listings need a build of the whole site
+        if not names:
+            return None
+        return names
+
+    def _begin_worker_build(self, config, site_map, asset_urls):
+        """Starts a build in a worker process with the state the main
+        process gathered for it. The compiled templates are kept, Jinja
+        recompiles the ones whose files changed, and so are the
+        translations of the .po files that didn't change."""
+        vars(self.config).update(vars(config))
+        self.site_map = site_map
+        self.site_context = self._site_context()
+        self.assets.urls = asset_urls
+        self.trans.drop_outdated()
+        self.jinja_env.fragment_cache.reset()
+        self._values = {}
+        self._titles = {}
+
+    def _begin_build(self):
+        self.profiler.start()
+        self.manifest.reset()
+        self.writer.reset()
+        self.jinja_env.fragment_cache.reset()
+        self._template_deps = {}
+        self._signature = None
+        self._values = {}
+        self._titles = {}
+
+    def _end_build(self):
+        self.manifest.save()
+        self.writer.log_summary()
+        self.jinja_env.fragment_cache.log_summary()
+        self.profiler.add_section('fragments', self.jinja_env.fragment_cache.summary())
+        self.profiler.add_phase('locale load', *self.trans.pop_load_time())
+        self.profiler.report()
 
     def _setup_logger(self):
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
         return logging.getLogger(__name__)
 
     def _setup_jinja_env(self):
-        jinja_env = Environment(loader=FileSystemLoader(self.config.ROOT_PATH / 'templates'))
+        # Element templates are loaded as 'pages/<name>/page.html' and
+        # 'posts/<name>/post.html', so that like the templates they extend
+        # they are compiled once and cached until their file changes.
+        loader = ChoiceLoader([
+            PrefixLoader({
+                'pages': FileSystemLoader(self.config.ROOT_PATH / 'pages'),
+                'posts': FileSystemLoader(self.config.ROOT_PATH / 'posts'),
+            }),
+            FileSystemLoader(self.config.ROOT_PATH / 'templates'),
+        ])
+        bytecode_cache = None
+        if self.config.bytecode_cache:
+            bytecode_cache_path = self.config.CACHE_PATH / 'bytecode'
+            os.makedirs(bytecode_cache_path, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(str(bytecode_cache_path), f'__quickdot{self.BYTECODE_VERSION}_%s.cache')
+        jinja_env = Environment(loader=loader, cache_size=-1, auto_reload=True, bytecode_cache=bytecode_cache,
+                                extensions=[FragmentCacheExtension])
+        # Includes and imports get the layers of the render, not a copy of them
+        jinja_env.context_class = LayeredContext
+        jinja_env.template_class = LayeredTemplate
 
-        def get_url_filter(element):
-            return element.get_url(self.context['_LANG'])
+        # Elements of all languages are rendered at the same time, so the
+        # filters take the language from the context of the render. They
+        # must stay context filters, otherwise Jinja would fold their calls
+        # on literals into the template with the language that compiled it.
+        # Elements are looked up in the navigation table of the language,
+        # so the filters don't format URLs or translate names on every call.
+        # The table is taken from the language layer of the render, which
+        # doesn't record the read: the filters record the single title they
+        # read rather than the whole table, see _render_group, and URLs only
+        # differ by the language.
+        def language_layer(context):
+            for layer in getattr(context.parent, 'maps', ()):
+                if isinstance(layer, LanguageLayer):
+                    return layer
+            # Templates imported without context don't get the layers
+            return None
+
+        def nav_entry(context, element):
+            layer = language_layer(context)
+            nav = context['_NAV'] if layer is None else layer.nav
+            return nav.entries.get(element.name)
+
+        def render_language(context):
+            layer = language_layer(context)
+            return context['_LANG'] if layer is None else layer.values['_LANG']
+
+        @pass_context
+        def get_url_filter(context, element):
+            entry = nav_entry(context, element)
+            return element.get_url(render_language(context)) if entry is None else entry.url
         
         def get_element_filter(name):
             return self.site_map.elements[name]
@@ -80,18 +383,42 @@ class Generator:
         def get_element_lang_url(data):
             return self.site_map.elements[data['element'].name].get_url(data['lang'])
         
-        def get_element_name(element):
-            return self.trans.get_text(element.name, self.context['_LANG'])
+        @pass_context
+        def get_element_name(context, element):
+            entry = nav_entry(context, element)
+            record_text(None, element.name)
+            return self.trans.get_text(element.name, language_of(render_language(context))) if entry is None else entry.title
         
-        def get_ttext(text):
+        @pass_context
+        def get_ttext(context, text):
             if isinstance(text, str):
-                return self.trans.get_text(text, self.context['_LANG'])
+                record_text(None, text)
+                return self.trans.get_text(text, language_of(render_language(context)))
             elif isinstance(text, dict):
-                return self.trans.get_text(text['text'], self.text['lang'])
+                record_text(text['lang'], text['text'])
+                return self.trans.get_text(text['text'], text['lang'])
             else:
                 return 'ERROR'
 
+        @pass_context
+        def is_active(context, element):
+            return context['_ELEMENT'] is element
+
+        # JSON and URL encoding read the characters of _LANG directly
+        def dumps(value, **kwargs):
+            return json.dumps(with_real_codes(value), **kwargs)
+
+        urlencode = jinja_env.filters['urlencode']
+
+        def urlencode_filter(value):
+            return urlencode(with_real_codes(value))
+
+        jinja_env.policies['json.dumps_function'] = dumps
+        jinja_env.filters['urlencode'] = urlencode_filter
+
+        jinja_env.globals['static_url'] = self.assets.url
         jinja_env.filters['get_ttext'] = get_ttext
+        jinja_env.tests['active'] = is_active
 
         jinja_env.filters['get_url'] = get_url_filter
         jinja_env.filters['get_element'] = get_element_filter
@@ -100,12 +427,35 @@ class Generator:
 
         return jinja_env
 
+    def _render_template(self, template, context):
+        """Renders the template with the layered context as is, where
+        Template.render would first copy it into a new dict."""
+        jinja_context = template.new_context(context, shared=True)
+        try:
+            return self.jinja_env.concat(template.root_render_func(jinja_context))
+        except Exception:
+            return self.jinja_env.handle_exception()
+
+    def _get_template(self, name):
+        """Returns the compiled template, compiling it only once even
+        when all its languages are being rendered at the same time."""
+        with self._template_locks_lock:
+            lock = self._template_locks.setdefault(name, threading.Lock())
+        with lock:
+            return self.jinja_env.get_template(name)
+
     def _copy_static_files(self):
-        shutil.copytree(self.config.site_static_path, self.config.site_output_path / "static", dirs_exist_ok=True)
+        # Every shard needs the fingerprinted URLs, the fingerprinted files
+        # are the same on all of them
+        self.assets.process()
+        if self._does_shared_work():
+            self.static_sync.sync(keep=self.assets.outputs())
 
     def _gather_data(self):
         self._gather_elements(ElementType.PAGE, self.config.site_pages)
         self._gather_elements(ElementType.POST, self.config.site_posts)
+        self.site_map.posts = PostIndex(self.site_map.elements[name] for name in self.config.site_posts)
+        self.site_context = self._site_context()
 
     def _gather_elements(self, type, elements):
         for name in elements:
@@ -120,85 +470,563 @@ class Generator:
         if postinfo_path.exists():
             with open(postinfo_path, 'r+', encoding='utf-8') as f:
                 postinfo = json.load(f)
-            date = str(postinfo.get('date', datetime_date.today()))
         else:
-            date = datetime_date.today()
-            postinfo = {'date': str(date)}
-        with open(postinfo_path, 'w+', encoding='utf-8') as f:
-            json.dump(postinfo, f, indent=4)
-        return PostElement(name, date)
+            postinfo = {}
+        # Only write the postinfo when it changes, rewriting it on every
+        # build would make the watcher rebuild forever
+        if 'date' not in postinfo:
+            postinfo['date'] = str(datetime_date.today())
+            with open(postinfo_path, 'w+', encoding='utf-8') as f:
+                json.dump(postinfo, f, indent=4)
+        return PostElement(name, str(postinfo['date']), tuple(postinfo.get('tags', ())), postinfo.get('summary'))
 
-    def _generate_site(self):
+    def _generate_site(self, elements=None, languages=None):
+        start = perf_counter()
         os.makedirs(self.config.site_output_path, exist_ok=True)
-        self._generate_pages()
-        self._generate_posts()
+        # Partial builds don't know the outputs of the rest of the site
+        full_build = elements is None and languages is None and self._is_partial_build() is False
+        languages = self.config.site_languages if languages is None else languages
+        languages = [lang for lang in languages if self._selects_language(lang)]
+        if not languages:
+            self.logger.warning('No language matches --only-lang.')
+        with self.profiler.phase('plan'):
+            tasks, skipped = self._plan_site(elements, languages)
+        rendered = reused = 0
+        if tasks:
+            values = {lang: self._language_values(lang) for lang in languages}
+            if self.config.executor == 'process':
+                rendered, reused = self._generate_in_processes(tasks, values)
+            else:
+                rendered, reused = self._generate_in_threads(tasks, values)
+        listings = []
+        if self._does_shared_work():
+            with self.profiler.phase('blog'):
+                listings = self._generate_blog(languages)
+        if full_build:
+            self._remove_stale_outputs(languages, listings)
+        self.logger.info(
+            f'Rendered {rendered} of {len(tasks)} outputs ({len(tasks) - rendered} failed, '
+            f'{skipped} up to date{f", {reused} reused from another language" if reused else ""}) '
+            f'in {perf_counter() - start:.2f}s.'
+        )
+
+    def _remove_stale_outputs(self, languages, listings):
+        """Removes the outputs of elements, languages and listing pages
+        that are no longer part of the site."""
+        expected = {
+            f'{lang}/{element_type}/{element}.html'
+            for element_type, names in (('pages', self.config.site_pages), ('posts', self.config.site_posts))
+            for lang in languages
+            for element in names
+        }
+        expected.update(page.path for page in listings)
+        for key in list(self.manifest.outputs):
+            if key not in expected:
+                self.logger.debug('Removing stale output %s.', key)
+                self.writer.remove(key)
+                self.manifest.forget(key)
+
+    def _plan_site(self, elements, languages):
+        """Plans every render of the build up front, the ones that took
+        the longest during the previous build first, so that the pool
+        stays busy until the very end."""
+        tasks = []
+        skipped = 0
+        for element_type, names in (('pages', self.config.site_pages), ('posts', self.config.site_posts)):
+            for lang in languages:
+                for element in names:
+                    if elements is not None and element not in elements:
+                        continue
+                    if self._selects_render(element, lang, element_type) is False:
+                        continue
+                    plan = self._plan_element(element, lang, element_type)
+                    if plan is None:
+                        self.logger.debug('Skipping %s %s for language %s, it is up to date.', element_type[:-1], element, lang)
+                        skipped += 1
+                        continue
+                    tasks.append(RenderTask(element_type, element, lang, plan))
+        # New elements have no render time yet, they go first
+        tasks.sort(key=lambda task: self.manifest.render_time(task.plan[0]), reverse=True)
+        return tasks, skipped
+
+    def _is_partial_build(self):
+        """Whether only a part of the site is built, see --only-lang,
+        --only-element and --shard."""
+        return any(option is not None for option in (self.config.only_langs, self.config.only_elements, self.config.shard))
+
+    def _does_shared_work(self):
+        """Whether the build syncs the static files and writes the blog
+        listings, the feeds and the sitemap, which only the first shard does."""
+        return self.config.shard is None or self.config.shard[0] == 1
+
+    def _selects_language(self, lang):
+        only_langs = self.config.only_langs
+        return only_langs is None or any(fnmatchcase(lang, pattern) for pattern in only_langs)
+
+    def _selects_render(self, element, lang, element_type):
+        """Whether the render belongs to this build. Shards are picked by
+        a hash of the output path, so every machine splits the plan the same
+        way, no matter the order of the elements or what was built before."""
+        only_elements = self.config.only_elements
+        if only_elements is not None and not any(
+            fnmatchcase(element, pattern) or fnmatchcase(f'{element_type}/{element}', pattern)
+            for pattern in only_elements
+        ):
+            return False
+        if self.config.shard is None:
+            return True
+        index, count = self.config.shard
+        return zlib.crc32(f'{lang}/{element_type}/{element}.html'.encode('utf-8')) % count == index - 1
+
+    def _site_signature(self):
+        """Describes the site map, which every element can link to, and the
+        fingerprinted asset URLs. Computed once per build."""
+        if self._signature is None:
+            site_map = '\n'.join(
+                f'{element.type.name} {element.name} {getattr(element, "date", "")} {getattr(element, "tags", "")}'
+                for element in self.site_map.elements.values()
+            )
+            self._signature = f'{site_map}\n{self.assets.signature()}'
+        return self._signature
+
+    def _template_dependencies(self, template_path):
+        """Returns all templates from the templates directory that the given
+        template extends, includes or imports, recursively."""
+        templates_path = self.config.ROOT_PATH / 'templates'
+        deps = set()
+        pending = [template_path]
+        while pending:
+            path = pending.pop()
+            if path not in self._template_deps:
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        ast = self.jinja_env.parse(f.read())
+                    names = list(meta.find_referenced_templates(ast))
+                except (OSError, UnicodeDecodeError):
+                    names = []
+                except Exception:
+                    names = [None]
+                if None in names:
+                    # Dynamic template names can't be resolved statically,
+                    # so such template depends on all of them.
+                    refs = [p for p in templates_path.rglob('*') if p.is_file()]
+                else:
+                    refs = [templates_path / name for name in names]
+                self._template_deps[path] = refs
+            for ref in self._template_deps[path]:
+                if ref not in deps:
+                    deps.add(ref)
+                    pending.append(ref)
+        return deps
+
+    def _element_inputs(self, element, lang, element_type):
+        """Returns all input files the given element's output depends on.
+        The translations are not among them, see _texts_signature."""
+        element_path = self.config.ROOT_PATH / element_type / element
+        template_path = element_path / f'{element_type[:-1]}.html'
+        deps = {
+            template_path,
+            element_path / 'context.json',
+            self.config.ROOT_PATH / 'site.config.json',
+        }
+        if element_type == 'posts':
+            deps.add(element_path / '.postinfo.json')
+        deps.update(self._template_dependencies(template_path))
+        return deps
+
+    def _plan_element(self, element, lang, element_type):
+        """Returns the manifest entry for the element's output, or None
+        if the output is up to date and doesn't need to be rendered."""
+        key = f'{lang}/{element_type}/{element}.html'
+        deps = self._element_inputs(element, lang, element_type)
+        # Outputs recorded without their translations are rendered again
+        texts = self.manifest.texts(key)
+        if texts is None:
+            return key, None, deps
+        digest = self._element_digest(deps, element, lang, element_type, texts, self.manifest.values(key))
+
+        outputs = [self.config.site_output_path / key]
+        if self._is_index(element, lang):
+            outputs.append(self.config.site_output_path / 'index.html')
+        if self.config.full_rebuild is False and self.manifest.is_fresh(key, digest, *outputs):
+            return None
+        return key, digest, deps
 
-    def _generate_pages(self):
-        self._generate_elements(self.config.site_pages, self._generate_page)
+    def _element_digest(self, deps, element, lang, element_type, texts, values):
+        return self.manifest.digest(deps, (
+            f'{self._site_signature()}\n{self._texts_signature(texts, lang)}\n'
+            f'{self._values_signature(values, element, lang, element_type)}'
+        ))
 
-    def _generate_posts(self):
-        self._generate_elements(self.config.site_posts, self._generate_post)
+    def _texts_signature(self, texts, lang):
+        """Describes the translations an output read when it was rendered,
+        so that editing a .po file only renders again the outputs that read
+        the changed entries. The texts are (language, key) pairs, the
+        language being None for the one the output was rendered in."""
+        digest = hashlib.sha256()
+        for text_lang, key in sorted(texts, key=lambda text: (text[0] or '', text[1])):
+            digest.update(f'{text_lang}\0{key}\0{self._text_value(text_lang or lang, key)}\n'.encode('utf-8'))
+        return digest.hexdigest()
 
-    def _generate_elements(self, elements, generate_element_func):
+    def _values_signature(self, names, element, lang, element_type):
+        """Describes the language dependent values an output read when it
+        was rendered, like the date of the build, so that it is rendered
+        again when they change."""
+        if not names:
+            return ''
+        values = self._language_values(lang)
+        if any(name not in values for name in names):
+            values = {**values, **self._element_values(element, lang, element_type)}
+        return '\n'.join(f'{name}\0{values.get(name)}' for name in sorted(names))
+
+    def _text_value(self, lang, key):
+        """Returns the translation of the key, None if it is missing.
+        Reading the navigation table reads the titles of all elements."""
+        if key == NAV_KEY:
+            return self._titles_digest(lang)
+        return self.trans.locale[lang].get(key)
+
+    def _titles_digest(self, lang):
+        """Returns the digest of the element titles of the language, computed once per build."""
+        titles = self._titles.get(lang)
+        if titles is None:
+            texts = self.trans.locale[lang]
+            titles = '\0'.join(texts.get(name, name) for name in self.site_map.elements)
+            titles = self._titles[lang] = hashlib.sha256(titles.encode('utf-8')).hexdigest()
+        return titles
+
+    def _record_output(self, task, render_time, texts, values):
+        """Records a rendered output in the manifest, with the digest of the
+        translations and language dependent values it actually read."""
+        key, _, deps = task.plan
+        digest = self._element_digest(deps, task.element, task.lang, task.element_type, texts, values)
+        self.manifest.record(key, digest, deps, render_time, texts, values)
+
+    def _compact_texts(self, texts):
+        """Replaces the titles of all elements, read by the navigation of
+        most templates, with the whole navigation table."""
+        if (None, NAV_KEY) not in texts and not all((None, name) in texts for name in self.site_map.elements):
+            return texts
+        return {text for text in texts if text[0] is not None or text[1] not in self.site_map.elements} | {(None, NAV_KEY)}
+
+    def _is_index(self, element, lang):
+        return element == self.config.site_index_page and lang == self.config.site_languages[0]
+
+    def _get_thread_pool(self):
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(max_workers=self.config.thread_count)
+        return self._thread_pool
+
+    def _group_tasks(self, tasks):
+        """Groups the renders of every element in all its languages when
+        deduplicating languages, see _render_group, keeping the order of the
+        plan. Otherwise every render is a group of its own."""
+        if self.config.dedup_languages is False:
+            return [[task] for task in tasks]
+        groups = {}
+        for task in tasks:
+            groups.setdefault((task.element_type, task.element), []).append(task)
+        return list(groups.values())
+
+    def _generate_in_threads(self, tasks, values):
+        """Renders the tasks in the thread pool and returns how many of them
+        were rendered successfully and how many of those reused the output
+        of another language."""
+        contexts = {lang: self._language_context(lang_values) for lang, lang_values in values.items()}
+        thread_pool = self._get_thread_pool()
+        futures = [
+            thread_pool.submit(self._render_group_and_record, group, contexts, values)
+            for group in self._group_tasks(tasks)
+        ]
+        reused = [was_reused for future in futures for was_reused in future.result()]
+        return len(reused), sum(reused)
+
+    def _generate_blog(self, languages):
+        """Renders the paginated blog listings of the given languages with
+        the blog.html template, if there is one, and writes the feeds and the
+        sitemap. Returns the listing pages of all languages."""
+        template_path = self.config.ROOT_PATH / 'templates' / 'blog.html'
+        has_listing = template_path.exists()
+        listings = []
+        futures = []
+        # The listing pages of the languages being built
+        planned = skipped = 0
         for lang in self.config.site_languages:
-            self.context['_LANG'] = lang
-            with ThreadPoolExecutor(max_workers=self.config.thread_count) as executor:
-                for key, value in self.trans.locale[lang].items():
-                    self.context[key] = value
-                context = self.context.copy()
-                context['_LANG'] = lang
-                context['_TIME'] = format_time(datetime_time.now(self.config.timezone), format='HH:mm:SS', locale=Locale.parse(lang))
-                context['_DATE'] = format_date(datetime_date.today(), format='long', locale=Locale.parse(lang))
-                for element in elements:
-                    executor.submit(self._run_with_exception_logging, generate_element_func, context, element, lang)
+            pages = self.site_map.posts.listing(lang, self.config.posts_per_page) if has_listing else []
+            listings.extend(pages)
+            if lang not in languages or not pages:
+                continue
+            planned += len(pages)
+            plan = self._plan_listing(lang, pages, template_path)
+            if plan is None:
+                skipped += len(pages)
+                continue
+            context = self._language_context(self._language_values(lang))
+            futures.append((pages, plan, [
+                self._get_thread_pool().submit(self._run_with_exception_logging, self._generate_listing, context, page)
+                for page in pages
+            ]))
+
+        rendered = 0
+        for pages, (digest, deps), page_futures in futures:
+            results = [future.result() is not False for future in page_futures]
+            rendered += sum(results)
+            if all(results):
+                for page in pages:
+                    self.manifest.record(page.path, digest, deps)
+        if planned:
+            self.logger.info(f'Rendered {rendered} of {planned - skipped} blog listing pages ({skipped} up to date).')
+
+        if self.config.site_posts:
+            for lang in languages:
+                self.feeds.write_feeds(self.site_map.posts, lang, self.trans.get_text)
+        self.feeds.write_sitemap(self.site_map, listings)
+        return listings
+
+    def _plan_listing(self, lang, pages, template_path):
+        """Returns the digest and inputs of the listing pages of a language,
+        or None if all of them are up to date."""
+        deps = {
+            template_path,
+            self.config.site_translation_path / f'texts_{lang}.po',
+            self.config.ROOT_PATH / 'site.config.json',
+        }
+        deps.update(self._template_dependencies(template_path))
+        digest = self.manifest.digest(deps, f'{self._site_signature()}\n{self.config.posts_per_page}')
+        if self.config.full_rebuild is False and all(
+            self.manifest.is_fresh(page.path, digest, self.config.site_output_path / page.path) for page in pages
+        ):
+            return None
+        return digest, deps
+
+    def _generate_listing(self, context, page):
+        self.logger.debug('Generating blog listing page %s.', page.path)
+        with self.profiler.thread_phase('template compile'):
+            template = self._get_template('blog.html')
+        # Listings are parts of the blog page, which is the active element
+        site_map_element = self.site_map.elements.get(self.config.site_blog_page)
+        token = _active_element.set(site_map_element)
+        try:
+            with self.profiler.thread_phase('render'):
+                rendered = self._render_template(template, context.new_child({'_LISTING': page, '_ELEMENT': site_map_element}))
+        finally:
+            _active_element.reset(token)
+        with self.profiler.thread_phase('write'):
+            self.writer.write(page.path, self._localize(rendered, page.lang))
+
+    def _get_process_pool(self):
+        if self._process_pool is None:
+            # Importing multiprocessing is left to the builds that use it
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._process_pool = ProcessPoolExecutor(max_workers=self.config.thread_count,
+                                                     initializer=_init_worker, initargs=(self.config,))
+        return self._process_pool
+
+    def _generate_in_processes(self, tasks, values):
+        """Dispatches the renders to a process pool in batches. The pool is
+        kept between the builds of the watcher and the build daemon, with
+        the templates and translations its workers loaded, so every build
+        only sends them the config, the site map and the asset URLs."""
+        from concurrent.futures.process import BrokenProcessPool
+
+        self._process_builds += 1
+        state = pickle.dumps((self.config, self.site_map, self.assets.urls), pickle.HIGHEST_PROTOCOL)
+        build = (self._process_builds, state)
+        groups = self._group_tasks(tasks)
+        batch_size = max(1, math.ceil(len(groups) / (self.config.thread_count * 4)))
+        executor = self._get_process_pool()
+        try:
+            futures = [
+                executor.submit(_render_batch, build, groups[i:i + batch_size], values)
+                for i in range(0, len(groups), batch_size)
+            ]
+            rendered_count = reused_count = 0
+            for future in futures:
+                rendered, profile, stats, fragment_stats = future.result()
+                for task, render_time, texts, read_values, reused in rendered:
+                    self._record_output(task, render_time, texts, read_values)
+                    self.writer.notify(task.plan[0], None)
+                    if self._is_index(task.element, task.lang):
+                        self.writer.notify('index.html', None)
+                    reused_count += reused
+                self.profiler.merge(*profile)
+                self.writer.add_stats(stats)
+                self.jinja_env.fragment_cache.add_stats(fragment_stats)
+                rendered_count += len(rendered)
+        except BrokenProcessPool:
+            # A worker died, the next build starts a fresh pool
+            self._process_pool = None
+            raise
+        return rendered_count, reused_count
+
+    def _language_values(self, lang):
+        """Returns the language dependent values, computed once per build
+        so that every worker renders the same ones."""
+        values = self._values.get(lang)
+        if values is None:
+            # Babel is only imported by builds that render something
+            from babel.dates import format_date, format_time
+
+            locale = self._locale(lang)
+            values = self._values[lang] = {
+                '_LANG': lang,
+                '_TIME': format_time(datetime_time.now(self.config.timezone), format='HH:mm:SS', locale=locale),
+                '_DATE': format_date(datetime_date.today(), format='long', locale=locale),
+            }
+        return values
+
+    def _locale(self, lang):
+        """Returns the Babel locale of the language, parsed only once."""
+        locale = self._locales.get(lang)
+        if locale is None:
+            from babel import Locale
+
+            locale = self._locales[lang] = Locale.parse(lang)
+        return locale
+
+    def _site_context(self):
+        """Returns the read-only context layer shared by all renders."""
+        return MappingProxyType({'_SITE_MAP': self.site_map, '_POSTS': self.site_map.posts, '_CONFIG': self.config})
+
+    def _language_context(self, values):
+        """Returns the context shared by all elements of a language, layered
+        over the site context. Every render adds its own layer on top of it,
+        so nothing is copied and nothing leaks between renders. The language
+        layer records the translations and values every render reads."""
+        lang = values['_LANG']
+        texts = self.trans.locale[lang]
+        if self.config.dedup_languages:
+            # Printed, the language is a placeholder, see _render_group
+            lang = LanguageCode(lang)
+            values = dict(values, _LANG=lang)
+        fallbacks = (self.site_context, self.jinja_env.globals)
+        language_layer = LanguageLayer(texts, values, self.site_map.language_nav(lang, texts), fallbacks)
+        return ChainMap(language_layer, *fallbacks)
+
+    def _localize(self, rendered, lang):
+        """Puts the language in place of its placeholder in the output."""
+        if self.config.dedup_languages:
+            return rendered.replace(LANG_PLACEHOLDER, lang)
+        return rendered
+
+    def _render(self, task, context):
+        """Renders the task, returning how long it took, the output and what
+        it read, or None on failure."""
+        start, start_cpu = perf_counter(), thread_time()
+        result = self._run_with_exception_logging(self._generate_element, context, task.element, task.lang, task.element_type)
+        if result is False:
+            return None
+        render_time = perf_counter() - start
+        self.profiler.add_render(task.element_type, task.element, task.lang, render_time, thread_time() - start_cpu)
+        return (render_time, *result)
+
+    def _render_group(self, tasks, contexts, values):
+        """Renders the tasks of a group, the languages of one element when
+        deduplicating languages. A language whose translations and language
+        dependent values read by the render of another language are the
+        same, and that render didn't use the language code for anything but
+        printing it, gets that language's output with its own code put in
+        place of the placeholder instead of a render of its own. Returns
+        the render time, the translations and values read and whether the
+        output was reused of every task that succeeded."""
+        results = []
+        renders = []
+        for task in tasks:
+            source = next((render for render in renders if self._can_reuse(task, render, values)), None)
+            if source is not None:
+                _, render_time, rendered, record, texts = source
+                if self._run_with_exception_logging(self._write_element, task.element, task.lang, task.element_type, rendered) is False:
+                    continue
+                self.logger.debug('Reusing the output of %s %s for language %s.', task.element_type[:-1], task.element, task.lang)
+                results.append((task, render_time, texts, sorted(record.values), True))
+                continue
+            result = self._render(task, contexts[task.lang])
+            if result is None:
+                continue
+            render_time, rendered, record = result
+            texts = self._compact_texts(record.texts)
+            if self.config.dedup_languages:
+                renders.append((task.lang, render_time, rendered, record, texts))
+            results.append((task, render_time, texts, sorted(record.values), False))
+        return results
+
+    def _can_reuse(self, task, render, values):
+        lang, _, _, record, _ = render
+        if record.language_dependent:
+            return False
+        if any(text_lang is None and self._text_value(lang, key) != self._text_value(task.lang, key)
+               for text_lang, key in record.texts):
+            return False
+        if record.values:
+            task_values = {**values[task.lang], **self._element_values(task.element, task.lang, task.element_type)}
+            return all(task_values.get(name) == value for name, value in record.values.items())
+        return True
+
+    def _render_group_and_record(self, tasks, contexts, values):
+        """Renders a group and records its outputs, returning for every
+        successful render whether it reused the output of another language."""
+        reused = []
+        for task, render_time, texts, read_values, was_reused in self._render_group(tasks, contexts, values):
+            self._record_output(task, render_time, texts, read_values)
+            reused.append(was_reused)
+        return reused
 
     def _run_with_exception_logging(self, func, *args, **kwargs):
         try:
-            func(*args, **kwargs)
+            return func(*args, **kwargs)
         except Exception as e:
             self.logger.error(f"Exception occurred during execution: {e}")
             self.logger.debug(traceback.format_exc())
             # If the exception needs to be propagated, re-raise it
             # raise
+            return False
 
-    def _generate_page(self, context, page, lang):
-        self._generate_element(context, page, lang, 'pages')
+    def _element_values(self, element, lang, element_type):
+        """Returns the language dependent values of the element."""
+        if element_type != 'posts':
+            return {}
+        from babel.dates import format_date
 
-    def _generate_post(self, context, post, lang):
-        site_map_element = self.site_map.elements[post]
-        date = datetime_date.fromisoformat(site_map_element.date)
-        context['_DATE_CREATED'] = format_date(date, format='long', locale=Locale.parse(lang))
-        self._generate_element(context, post, lang, 'posts')
+        date = datetime_date.fromisoformat(self.site_map.elements[element].date)
+        return {'_DATE_CREATED': format_date(date, format='long', locale=self._locale(lang))}
 
     def _generate_element(self, context, element, lang, element_type):
-        self.logger.info(f'Generating {element_type[:-1]} {element} for language {lang}.')
-        element_file_path = Path(element_type) / element / f'{element_type[:-1]}.html'
-        with open(element_file_path, 'r+', encoding='utf-8') as f:
-            element_content = f.read()
+        """Renders the element and writes its output. Returns the output,
+        with the placeholder of the language if deduplicating languages, and
+        the record of what the render read."""
+        self.logger.debug('Generating %s %s for language %s.', element_type[:-1], element, lang)
+        with self.profiler.thread_phase('template compile'):
+            template = self._get_template(f'{element_type}/{element}/{element_type[:-1]}.html')
+        element_context = {}
         element_context_path = Path(element_type) / element / 'context.json'
-        if element_context_path.exists() is False:
-            element_context = {}
-        else:
+        if element_context_path.exists():
             with open(element_context_path, 'r+', encoding='utf-8') as f:
-                element_context = json.load(f)
-        context.update(element_context)
+                element_context.update(json.load(f))
 
         site_map_element = self.site_map.elements[element]
-        site_map_element.toggle_active()
-        context['_ELEMENT'] = site_map_element
-        template = self.jinja_env.from_string(element_content, context)
-        rendered = template.render(context)
-        site_map_element.toggle_active()
-
-        element_url = self.config.site_output_path / lang / element_type / f'{element}.html'
-        os.makedirs(element_url.parent, exist_ok=True)
-        with open(element_url, '+w', encoding='utf-8') as f:
-            f.write(rendered)
-        if element == self.config.site_index_page and lang == self.config.site_languages[0]:
-            self.logger.info(f'Generating index page...')
-            index_url = self.config.site_output_path / 'index.html'
-            with open(index_url, '+w', encoding='utf-8') as f:
-                f.write(rendered)
-
-        self.logger.info(f'Writing {element_type[:-1]} {element} for language {lang} to {element_url}.')
-        self.logger.info(f'Generated {element_type[:-1]} {element} for language {lang}.')
+        element_context['_ELEMENT'] = site_map_element
+        # The values of the element are shadowed by its context.json
+        element_values = self._element_values(element, lang, element_type)
+        token = _active_element.set(site_map_element)
+        if element_values:
+            context = context.new_child(ValuesLayer(element_values))
+        try:
+            with self.profiler.thread_phase('render'), recording(RenderRecord()) as record:
+                rendered = self._render_template(template, context.new_child(element_context))
+        finally:
+            _active_element.reset(token)
+
+        self._write_element(element, lang, element_type, rendered)
+        return rendered, record
+
+    def _write_element(self, element, lang, element_type, rendered):
+        element_url = f'{lang}/{element_type}/{element}.html'
+        rendered = self._localize(rendered, lang)
+        self.logger.debug('Writing %s %s for language %s to %s.', element_type[:-1], element, lang, element_url)
+        with self.profiler.thread_phase('write'):
+            self.writer.write(element_url, rendered)
+            if self._is_index(element, lang):
+                # The index page is written from the same render
+                self.logger.debug('Generating index page...')
+                self.writer.write('index.html', rendered)
@@ -0,0 +1,128 @@
+import json
+import hashlib
+import logging
+import threading
+
+
+class BuildManifest:
+    """Keeps track of the inputs every generated output was rendered from,
+    so that unchanged outputs can be skipped on the next build."""
+
+    VERSION = 3
+
+    def __init__(self, config):
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+        self.path = self.config.ROOT_PATH / '.buildmanifest'
+
+        self.outputs = {}
+        self._hashes = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Loads the manifest written by the previous build."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self.outputs = data['outputs']
+        except FileNotFoundError:
+            self.outputs = {}
+        except (json.JSONDecodeError, KeyError, AttributeError):
+            self.logger.warning(f'Invalid build manifest {self.path}, ignoring it.')
+            self.outputs = {}
+
+    def save(self):
+        """Writes the manifest to disk."""
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'outputs': self.outputs}, f, indent=1, sort_keys=True)
+
+    def reset(self):
+        """Forgets the file hashes computed during the previous build."""
+        self._hashes = {}
+
+    def relative(self, path):
+        """Returns the manifest key of the given path."""
+        try:
+            return self.config.ROOT_PATH.joinpath(path).relative_to(self.config.ROOT_PATH).as_posix()
+        except ValueError:
+            return str(path)
+
+    def file_hash(self, path):
+        """Returns the content hash of the file, or None if it doesn't exist."""
+        key = self.relative(path)
+        with self._lock:
+            if key in self._hashes:
+                return self._hashes[key]
+        try:
+            with open(self.config.ROOT_PATH / key, 'rb') as f:
+                file_hash = hashlib.sha256(f.read()).hexdigest()
+        except (FileNotFoundError, IsADirectoryError):
+            file_hash = None
+        with self._lock:
+            self._hashes[key] = file_hash
+        return file_hash
+
+    def digest(self, paths, extra=''):
+        """Combines the hashes of all the given input files into one digest."""
+        digest = hashlib.sha256(extra.encode('utf-8'))
+        for path in sorted(self.relative(p) for p in paths):
+            digest.update(f'\0{path}\0{self.file_hash(path)}'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def is_fresh(self, key, digest, *output_paths):
+        """Checks whether the output was already rendered from the same inputs."""
+        entry = self.outputs.get(key)
+        if entry is None or entry['digest'] != digest:
+            return False
+        return all(p.exists() for p in output_paths)
+
+    def record(self, key, digest, deps, render_time=None, texts=None, values=None):
+        """Records the inputs of a freshly rendered output, along with the
+        (language, key) pairs of the translations and the names of the
+        language dependent values it read, if known."""
+        entry = {'digest': digest, 'deps': sorted(self.relative(p) for p in deps)}
+        if render_time is not None:
+            entry['time'] = render_time
+        if texts is not None:
+            # The keys read in every language, '' standing for the rendered one
+            entry['texts'] = {}
+            for lang, text in sorted(texts, key=lambda text: (text[0] or '', text[1])):
+                entry['texts'].setdefault(lang or '', []).append(text)
+        if values:
+            entry['values'] = sorted(values)
+        with self._lock:
+            self.outputs[key] = entry
+
+    def forget(self, key):
+        """Forgets an output that is no longer generated."""
+        with self._lock:
+            self.outputs.pop(key, None)
+
+    def texts(self, key):
+        """Returns the translations the output read during the last build
+        it was rendered in, or None if they are not known."""
+        entry = self.outputs.get(key)
+        if entry is None or 'texts' not in entry:
+            return None
+        return [(lang or None, text) for lang, texts in entry['texts'].items() for text in texts]
+
+    def values(self, key):
+        """Returns the names of the language dependent values the output
+        read during the last build it was rendered in."""
+        entry = self.outputs.get(key)
+        return [] if entry is None else entry.get('values', [])
+
+    def render_time(self, key):
+        """Returns how long the output took to render during the last
+        build it was rendered in, or infinity if it is not known."""
+        entry = self.outputs.get(key)
+        if entry is None:
+            return float('inf')
+        return entry.get('time', float('inf'))
+
+    def dependents(self, path):
+        """Returns the keys of all outputs that depend on the given input."""
+        path = self.relative(path)
+        return [key for key, entry in self.outputs.items() if path in entry['deps']]
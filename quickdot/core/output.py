@@ -0,0 +1,99 @@
+import os
+import logging
+import threading
+
+
+class OutputWriter:
+    """Writes the generated files atomically, leaving the ones whose
+    content didn't change untouched, so that deploys only ship real changes."""
+
+    def __init__(self, config, assets=None):
+        self.config = config
+        # Minifies and pre-compresses the outputs when enabled
+        self.assets = assets
+        self.logger = logging.getLogger(__name__)
+        # Called with the path relative to the output directory and the
+        # content of every page written, or None if the content is not known
+        self.listeners = []
+
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Starts counting the files of a new build."""
+        self.stats = {'written': 0, 'unchanged': 0, 'removed': 0}
+
+    def write(self, relpath, content):
+        """Writes the content to the file unless it already holds it."""
+        if self.assets is not None:
+            content = self.assets.process_page(relpath, content)
+        data = content
+        if os.linesep != '\n':
+            # Keep writing the platform's newlines, like text mode did
+            data = data.replace('\n', os.linesep)
+        data = data.encode('utf-8')
+
+        path = self.config.site_output_path / relpath
+        if self._holds(path, data):
+            self._count('unchanged')
+            if self.assets is not None:
+                self.assets.compress(path, data, only_missing=True)
+        else:
+            os.makedirs(path.parent, exist_ok=True)
+            tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            if self.assets is not None:
+                self.assets.compress(path, data)
+            self._count('written')
+        self.notify(relpath, content)
+
+    def remove(self, relpath):
+        """Removes a file that is no longer generated."""
+        path = self.config.site_output_path / relpath
+        if self.assets is not None:
+            self.assets.remove_compressed(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self._count('removed')
+        self.notify(relpath, None)
+
+    def notify(self, relpath, content):
+        for listener in self.listeners:
+            listener(relpath, content)
+
+    def pop_stats(self):
+        """Returns and resets the counts, used to send the counts of
+        worker processes to the main one."""
+        with self._lock:
+            stats = self.stats
+            self.reset()
+        return stats
+
+    def add_stats(self, stats):
+        with self._lock:
+            for name, count in stats.items():
+                self.stats[name] += count
+
+    def log_summary(self):
+        self.logger.info(
+            f'Output files: {self.stats["written"]} written, {self.stats["unchanged"]} unchanged, '
+            f'{self.stats["removed"]} removed.'
+        )
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    @staticmethod
+    def _holds(path, data):
+        try:
+            if os.path.getsize(path) != len(data):
+                return False
+            with open(path, 'rb') as f:
+                return f.read() == data
+        except FileNotFoundError:
+            return False
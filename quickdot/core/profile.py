@@ -0,0 +1,113 @@
+import json
+import logging
+import threading
+from time import perf_counter, process_time, thread_time
+from contextlib import contextmanager
+
+
+class BuildProfiler:
+    """Records the wall and CPU time of the build phases and of every
+    render, and reports the slowest ones."""
+
+    def __init__(self, config):
+        self.config = config
+        self.enabled = config.profile
+        self.logger = logging.getLogger(__name__)
+
+        self.phases = {}
+        self.renders = []
+        # Other statistics of the build, written to the JSON report as they are
+        self.sections = {}
+        self._lock = threading.Lock()
+        self._start = None
+
+    def start(self):
+        """Starts profiling a new build."""
+        self.phases = {}
+        self.renders = []
+        self.sections = {}
+        self._start = (perf_counter(), process_time())
+
+    @contextmanager
+    def phase(self, name):
+        """Measures a phase run by the calling thread."""
+        if self.enabled is False:
+            yield
+            return
+        wall, cpu = perf_counter(), process_time()
+        try:
+            yield
+        finally:
+            self.add_phase(name, perf_counter() - wall, process_time() - cpu)
+
+    @contextmanager
+    def thread_phase(self, name):
+        """Measures a part of a phase run in a worker thread. The times of
+        all workers are summed up, so they can exceed the wall time of the build."""
+        if self.enabled is False:
+            yield
+            return
+        wall, cpu = perf_counter(), thread_time()
+        try:
+            yield
+        finally:
+            self.add_phase(name, perf_counter() - wall, thread_time() - cpu)
+
+    def add_phase(self, name, wall, cpu):
+        with self._lock:
+            phase = self.phases.setdefault(name, [0.0, 0.0])
+            phase[0] += wall
+            phase[1] += cpu
+
+    def add_render(self, element_type, element, lang, wall, cpu):
+        if self.enabled:
+            with self._lock:
+                self.renders.append((element_type, element, lang, wall, cpu))
+
+    def add_section(self, name, data):
+        if self.enabled:
+            self.sections[name] = data
+
+    def pop(self):
+        """Returns and forgets everything recorded so far, used to send
+        the times measured by worker processes to the main one."""
+        with self._lock:
+            phases, renders = self.phases, self.renders
+            self.phases, self.renders = {}, []
+        return phases, renders
+
+    def merge(self, phases, renders):
+        for name, (wall, cpu) in phases.items():
+            self.add_phase(name, wall, cpu)
+        with self._lock:
+            self.renders.extend(renders)
+
+    def report(self):
+        """Logs the phases and the slowest renders and writes the JSON report."""
+        if self.enabled is False or self._start is None:
+            return
+        total = [perf_counter() - self._start[0], process_time() - self._start[1]]
+
+        self.logger.info(f'Build took {total[0]:.3f}s wall, {total[1]:.3f}s CPU.')
+        for name, (wall, cpu) in self.phases.items():
+            self.logger.info(f'  {name:<20} {wall:9.3f}s wall {cpu:9.3f}s CPU')
+
+        slowest = sorted(self.renders, key=lambda render: render[3], reverse=True)[:self.config.profile_top]
+        if slowest:
+            self.logger.info(f'Slowest {len(slowest)} renders:')
+        for element_type, element, lang, wall, cpu in slowest:
+            self.logger.info(f'  {element_type[:-1]} {element} ({lang}) {wall:9.3f}s wall {cpu:9.3f}s CPU')
+
+        report = {
+            'total': {'wall': total[0], 'cpu': total[1]},
+            'phases': {name: {'wall': wall, 'cpu': cpu} for name, (wall, cpu) in self.phases.items()},
+            'renders': [
+                {'type': element_type, 'element': element, 'lang': lang, 'wall': wall, 'cpu': cpu}
+                for element_type, element, lang, wall, cpu in self.renders
+            ],
+            **self.sections,
+        }
+        self.config.profile_output.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.config.profile_output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        self.logger.info(f'Profile written to {self.config.profile_output}.')
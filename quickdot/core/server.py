@@ -0,0 +1,229 @@
+import os
+import re
+import queue
+import hashlib
+import logging
+import threading
+import http.server
+from urllib.parse import urlsplit, unquote
+
+# Endpoint streaming the live reload notifications as server-sent events
+LIVE_RELOAD_PATH = '/__quickdot/livereload'
+LIVE_RELOAD_SCRIPT = (
+    '<script>new EventSource("' + LIVE_RELOAD_PATH + '")'
+    '.addEventListener("reload", function () { location.reload(); });</script>'
+).encode('utf-8')
+
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+def inject_live_reload(content):
+    """Adds the live reload script to the HTML page."""
+    index = content.rfind(b'</body>')
+    if index == -1:
+        return content + LIVE_RELOAD_SCRIPT
+    return content[:index] + LIVE_RELOAD_SCRIPT + content[index:]
+
+
+class PageCache:
+    """Pages rendered by the generator, kept in memory for the preview server."""
+
+    def __init__(self):
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def update(self, relpath, content):
+        """Stores the freshly rendered page, or forgets it if its content
+        is not known, so that it is read from the disk instead. Other
+        outputs, like the feeds and the sitemap, are always read from the
+        disk and served with their own content type."""
+        if content is None or not relpath.endswith('.html'):
+            with self._lock:
+                self._pages.pop(relpath, None)
+            return
+        content = inject_live_reload(content.encode('utf-8'))
+        etag = f'"{hashlib.sha1(content).hexdigest()}"'
+        with self._lock:
+            self._pages[relpath] = (content, etag)
+
+    def get(self, relpath):
+        with self._lock:
+            return self._pages.get(relpath)
+
+
+class PreviewRequestHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._serve(head=False)
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def log_message(self, format, *args):
+        logging.debug('%s - %s', self.address_string(), format % args)
+
+    def _serve(self, head):
+        path = unquote(urlsplit(self.path).path)
+        if path == LIVE_RELOAD_PATH:
+            self._serve_events()
+            return
+
+        relpath = path.lstrip('/')
+        if relpath == '' or relpath.endswith('/'):
+            relpath += 'index.html'
+        file_path = os.path.realpath(os.path.join(self.server.output_path, relpath))
+        if os.path.commonpath([file_path, self.server.output_path]) != self.server.output_path:
+            self.send_error(404, 'File not found')
+            return
+        if os.path.isdir(file_path):
+            relpath = f'{relpath}/index.html'
+            file_path = os.path.join(file_path, 'index.html')
+
+        page = self.server.pages.get(relpath)
+        if page is not None:
+            self._send_content(*page, 'text/html; charset=utf-8', head)
+            return
+        if os.path.isfile(file_path) is False:
+            self.send_error(404, 'File not found')
+            return
+        if file_path.endswith('.html'):
+            with open(file_path, 'rb') as f:
+                content = inject_live_reload(f.read())
+            self._send_content(content, f'"{hashlib.sha1(content).hexdigest()}"', 'text/html; charset=utf-8', head)
+            return
+        self._send_file(file_path, head)
+
+    def _not_modified(self, etag):
+        if etag in (tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return True
+        return False
+
+    def _send_content(self, content, etag, content_type, head):
+        if self._not_modified(etag):
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if head is False:
+            self.wfile.write(content)
+
+    def _send_file(self, file_path, head):
+        """Sends a static file, supporting conditional and range requests."""
+        stat = os.stat(file_path)
+        size = stat.st_size
+        etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+        if self._not_modified(etag):
+            return
+
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get('Range')
+        if range_header is not None and self.headers.get('If-Range', etag) == etag:
+            match = RANGE_PATTERN.match(range_header.strip())
+            if match is None or match.groups() == ('', ''):
+                self._send_unsatisfiable(size)
+                return
+            first, last = match.groups()
+            if first == '':
+                start = max(0, size - int(last))
+            else:
+                start = int(first)
+                end = min(end, int(last)) if last else end
+            if start > end or start >= size:
+                self._send_unsatisfiable(size)
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', self.guess_type(file_path))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        if head:
+            return
+
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(remaining, 1 << 16))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def _send_unsatisfiable(self, size):
+        self.send_response(416)
+        self.send_header('Content-Range', f'bytes */{size}')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _serve_events(self):
+        """Streams a reload event to the browser after every rebuild."""
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        events = self.server.subscribe()
+        try:
+            while True:
+                try:
+                    build = events.get(timeout=15)
+                    message = f'event: reload\ndata: {build}\n\n'
+                except queue.Empty:
+                    message = ': keep-alive\n\n'
+                self.wfile.write(message.encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.server.unsubscribe(events)
+
+
+class PreviewServer(http.server.ThreadingHTTPServer):
+    """Serves the generated site, every request in its own thread, and
+    notifies connected browsers when they should reload."""
+
+    daemon_threads = True
+
+    def __init__(self, config):
+        super().__init__(('localhost', config.live_server_port), PreviewRequestHandler)
+        self.config = config
+        self.output_path = os.path.realpath(config.site_output_path)
+        self.pages = PageCache()
+
+        self._subscribers = set()
+        self._subscribers_lock = threading.Lock()
+        self._build = 0
+
+    def subscribe(self):
+        events = queue.Queue()
+        with self._subscribers_lock:
+            self._subscribers.add(events)
+        return events
+
+    def unsubscribe(self, events):
+        with self._subscribers_lock:
+            self._subscribers.discard(events)
+
+    def notify_reload(self):
+        """Tells all connected browsers to reload, returning how many there were."""
+        with self._subscribers_lock:
+            self._build += 1
+            for events in self._subscribers:
+                events.put(self._build)
+            return len(self._subscribers)
@@ -0,0 +1,128 @@
+import os
+import shutil
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl cloning a file on copy-on-write filesystems (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+class StaticSync:
+    """Mirrors the static directory into the output directory,
+    copying only the files that changed."""
+
+    COPIED = 'copied'
+    SKIPPED = 'skipped'
+    REMOVED = 'removed'
+
+    def __init__(self, config):
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+        self.source_path = self.config.ROOT_PATH / self.config.site_static_path
+        self.output_path = self.config.site_output_path / 'static'
+
+    def sync(self, keep=()):
+        """Synchronizes the whole static directory, keeping the given
+        output files written by the asset pipeline."""
+        files = set()
+        for dirpath, _, filenames in os.walk(self.source_path):
+            for filename in filenames:
+                files.add(os.path.relpath(os.path.join(dirpath, filename), self.source_path))
+
+        with ThreadPoolExecutor(max_workers=self.config.thread_count) as executor:
+            results = list(executor.map(self._sync_file, sorted(files)))
+        results.extend(self._remove_stale(files | {os.path.normpath(path) for path in keep}))
+
+        self.logger.info(
+            f'Synchronized static files: {results.count(self.COPIED)} copied, '
+            f'{results.count(self.SKIPPED)} unchanged, {results.count(self.REMOVED)} removed.'
+        )
+
+    def sync_file(self, path):
+        """Synchronizes a single file of the static directory, removing
+        it from the output if it no longer exists."""
+        return self._sync_file(os.path.relpath(path, self.source_path))
+
+    def _sync_file(self, relpath):
+        src = os.path.join(self.source_path, relpath)
+        dst = os.path.join(self.output_path, relpath)
+        try:
+            src_stat = os.stat(src)
+        except FileNotFoundError:
+            if os.path.exists(dst):
+                os.remove(dst)
+                return self.REMOVED
+            return self.SKIPPED
+
+        if self._is_unchanged(src, dst, src_stat):
+            return self.SKIPPED
+
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp = f'{dst}.quickdot-tmp'
+        if self.config.static_link:
+            self._link(src, tmp)
+        else:
+            shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+        return self.COPIED
+
+    def _is_unchanged(self, src, dst, src_stat):
+        try:
+            dst_stat = os.stat(dst)
+        except FileNotFoundError:
+            return False
+        if self.config.static_link and os.path.samestat(src_stat, dst_stat):
+            return True
+        if src_stat.st_size != dst_stat.st_size:
+            return False
+        if src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+            return True
+        # Same size but different mtime, e.g. after a fresh checkout
+        if self.config.static_link or self._file_hash(src) != self._file_hash(dst):
+            return False
+        shutil.copystat(src, dst)
+        return True
+
+    def _link(self, src, dst):
+        """Reflinks the file where the filesystem supports it, hardlinks
+        it otherwise, and copies it as the last resort."""
+        if fcntl is not None:
+            try:
+                with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+                    fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+                shutil.copystat(src, dst)
+                return
+            except OSError:
+                if os.path.exists(dst):
+                    os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    def _remove_stale(self, files):
+        """Removes the output files that no longer exist in the static directory."""
+        results = []
+        for dirpath, dirnames, filenames in os.walk(self.output_path, topdown=False):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if os.path.relpath(path, self.output_path) not in files:
+                    os.remove(path)
+                    results.append(self.REMOVED)
+            if dirpath != str(self.output_path) and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+        return results
+
+    @staticmethod
+    def _file_hash(path):
+        file_hash = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                file_hash.update(chunk)
+        return file_hash.digest()
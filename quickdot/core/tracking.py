@@ -0,0 +1,284 @@
+from contextvars import ContextVar
+from collections import ChainMap
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+from jinja2 import Template
+from jinja2.runtime import Context, missing
+
+# Stands for the language in outputs rendered while deduplicating languages,
+# a private use character that neither escaping nor minification touch
+LANG_PLACEHOLDER = '\ue000'
+# Records the reads of the whole navigation table, see LanguageLayer
+NAV_KEY = '_NAV'
+
+# What the render running in the current thread has read
+_active_record = ContextVar('active_record', default=None)
+
+_STR_METHODS = frozenset(name for name in dir(str) if not name.startswith('__'))
+
+
+class RenderRecord:
+    """The translations and language dependent values a render read."""
+
+    def __init__(self):
+        # (language, key) pairs, the language being None for the rendered one
+        self.texts = set()
+        self.values = {}
+        # Whether the render used the language code for more than printing it
+        self.language_dependent = False
+
+    def merge(self, other):
+        self.texts.update(other.texts)
+        self.values.update(other.values)
+        self.language_dependent = self.language_dependent or other.language_dependent
+
+
+@contextmanager
+def recording(record):
+    """Records the reads of the calling thread into the record."""
+    token = _active_record.set(record)
+    try:
+        yield record
+    finally:
+        _active_record.reset(token)
+
+
+def current_record():
+    return _active_record.get()
+
+
+def record_text(lang, key):
+    record = _active_record.get()
+    if record is not None:
+        record.texts.add((lang, key))
+
+
+def record_value(name, value):
+    record = _active_record.get()
+    if record is not None:
+        record.values[name] = value
+
+
+def language_of(lang):
+    """Returns the language code behind the _LANG of a render."""
+    return lang.code if isinstance(lang, LanguageCode) else lang
+
+
+def with_real_codes(value):
+    """Returns the value with the language code in place of every _LANG
+    in it, marking the render as depending on the language. Used by the
+    filters that encode strings themselves instead of printing them, and
+    would encode the placeholder."""
+    if isinstance(value, LanguageCode):
+        return value._code()
+    if isinstance(value, dict):
+        return {with_real_codes(key): with_real_codes(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(with_real_codes(item) for item in value)
+    return value
+
+
+class LanguageCode(str):
+    """The _LANG of a render while deduplicating languages. Printed, it is a
+    placeholder replaced by the language in the output, so that the output
+    can be reused by other languages. Used in any other way it behaves
+    like the language code and marks the render as depending on it."""
+
+    def __new__(cls, code):
+        self = super().__new__(cls, LANG_PLACEHOLDER)
+        self.code = code
+        return self
+
+    def _code(self):
+        record = _active_record.get()
+        if record is not None:
+            record.language_dependent = True
+        return self.code
+
+    def __getattribute__(self, name):
+        if name in _STR_METHODS:
+            return getattr(LanguageCode._code(self), name)
+        return super().__getattribute__(name)
+
+    def __str__(self):
+        return LANG_PLACEHOLDER
+
+    def __format__(self, format_spec):
+        if format_spec == '':
+            return LANG_PLACEHOLDER
+        return format(self._code(), format_spec)
+
+    def __reduce__(self):
+        return LanguageCode, (self.code,)
+
+    def __bool__(self):
+        return True
+
+    def __repr__(self):
+        return repr(self._code())
+
+    def __hash__(self):
+        return hash(self._code())
+
+    def __eq__(self, other):
+        return self._code() == language_of(other)
+
+    def __ne__(self, other):
+        return self._code() != language_of(other)
+
+    def __lt__(self, other):
+        return self._code() < language_of(other)
+
+    def __le__(self, other):
+        return self._code() <= language_of(other)
+
+    def __gt__(self, other):
+        return self._code() > language_of(other)
+
+    def __ge__(self, other):
+        return self._code() >= language_of(other)
+
+    def __len__(self):
+        return len(self._code())
+
+    def __iter__(self):
+        return iter(self._code())
+
+    def __contains__(self, item):
+        return item in self._code()
+
+    def __getitem__(self, index):
+        return self._code()[index]
+
+    def __add__(self, other):
+        return self._code() + other
+
+    def __radd__(self, other):
+        return other + self._code()
+
+    def __mul__(self, count):
+        return self._code() * count
+
+    __rmul__ = __mul__
+
+    def __mod__(self, values):
+        return self._code() % values
+
+    def __rmod__(self, template):
+        return template % self._code()
+
+
+class LanguageLayer(Mapping):
+    """The context layer of a language: its translations, its language
+    dependent values and its navigation table. Records which of them the
+    render reads. Every global and site variable is looked up here first,
+    so names missing from the catalog are only recorded when none of the
+    fallback layers below it has them: a translation added later would
+    change what the render reads."""
+
+    def __init__(self, texts, values, nav, fallbacks=()):
+        self.texts = texts
+        self.values = values
+        self.nav = nav
+        self.fallbacks = fallbacks
+
+    def __getitem__(self, key):
+        if key in self.values:
+            value = self.values[key]
+            # The language itself is tracked by LanguageCode
+            if key != '_LANG':
+                record_value(key, value)
+            return value
+        if key == NAV_KEY:
+            record_text(None, NAV_KEY)
+            return self.nav
+        try:
+            value = self.texts[key]
+        except KeyError:
+            self._record_miss(key)
+            raise
+        record_text(None, key)
+        return value
+
+    def __contains__(self, key):
+        if key in self.values or key == NAV_KEY or key in self.texts:
+            return True
+        self._record_miss(key)
+        return False
+
+    def _record_miss(self, key):
+        if not any(key in layer for layer in self.fallbacks):
+            record_text(None, key)
+
+    def __iter__(self):
+        yield from self.values
+        yield NAV_KEY
+        yield from (key for key in self.texts if key not in self.values and key != NAV_KEY)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class ValuesLayer(Mapping):
+    """A context layer of language dependent values, recording which of
+    them the render reads."""
+
+    def __init__(self, values):
+        self.values = values
+
+    def __getitem__(self, key):
+        value = self.values[key]
+        record_value(key, value)
+        return value
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+
+def _layers(vars):
+    return vars.maps if isinstance(vars, ChainMap) else [vars]
+
+
+def _with_locals(vars, locals):
+    """Layers the local variables of a template over its context."""
+    return ChainMap({key: value for key, value in locals.items() if value is not missing}, *_layers(vars))
+
+
+class LayeredContext(Context):
+    """A Jinja context passing its layers on to the contexts derived from
+    it, where Jinja would copy them into a dict: includes in loops or after
+    a {% set %}, imports with context and context functions called in
+    loops. A copy would read, and record, every translation."""
+
+    def get_all(self):
+        if not self.vars:
+            return self.parent
+        return ChainMap(dict(self.vars), *_layers(self.parent))
+
+    def derived(self, locals=None):
+        parent = self.get_all()
+        if locals:
+            parent = _with_locals(parent, locals)
+        context = type(self)(self.environment, parent, self.name, {})
+        context.eval_ctx = self.eval_ctx
+        context.blocks.update((name, list(blocks)) for name, blocks in self.blocks.items())
+        return context
+
+
+class LayeredTemplate(Template):
+    """A Jinja template layering the variables of includes and imports
+    over the context they share, instead of copying it, see LayeredContext."""
+
+    def new_context(self, vars=None, shared=False, locals=None):
+        if shared and locals and isinstance(vars, ChainMap):
+            return self.environment.context_class(
+                self.environment, _with_locals(vars, locals), self.name, self.blocks, globals=self.globals,
+            )
+        return super().new_context(vars, shared, locals)
@@ -1,18 +1,46 @@
+import os
 import json
+import marshal
+import hashlib
 import logging
+import threading
 from pathlib import Path
+from time import perf_counter, process_time
+from concurrent.futures import ThreadPoolExecutor
 
-import polib
+
+class LocaleTables(dict):
+    """The locale data of every language, loaded on first use."""
+
+    def __init__(self, load):
+        super().__init__()
+        self._load = load
+        self._lock = threading.Lock()
+
+    def __missing__(self, lang):
+        with self._lock:
+            if dict.__contains__(self, lang) is False:
+                self[lang] = self._load(lang)
+            return dict.__getitem__(self, lang)
 
 
 class TranslationManager:
     """Manages the translations for the website."""
+
+    # Directories that never contain string tables
+    PRUNED_DIRS = {'.git', '.hg', '.svn', 'node_modules', '__pycache__'}
+    # Bumped whenever the format of compiled catalogs or the way they
+    # are parsed changes
+    CATALOG_VERSION = 2
     
     def __init__(self, config):
         self.config = config
-        self.locale = {}
         self.logger = logging.getLogger(__name__)
-        self._load_locale()
+        self._load_time = [0.0, 0.0]
+        # The modification time and size of every loaded .po file
+        self._stamps = {}
+        # Languages are loaded on first use
+        self.locale = LocaleTables(self._load_lang)
         
     def gather_texts(self):
         """Gathers texts from string_table.json files and saves to .po files."""
@@ -24,13 +52,16 @@ class TranslationManager:
     def _gather_texts_from_files(self):
         """Gathers texts from string_table.json files."""
         collected_data = {}
-        files = self.config.ROOT_PATH.rglob('string_table.json')
+        files = sorted(self._find_string_tables())
 
-        for file in files:
-            with open(file, 'r+', encoding='utf-8') as f:
+        # Parse in parallel, but merge in order so duplicates are reported
+        # the same way on every run
+        with ThreadPoolExecutor(max_workers=self.config.thread_count) as executor:
+            tables = executor.map(self._read_string_table, files)
+            for file, data in zip(files, tables):
+                if data is None:
+                    continue
                 try:
-                    self.logger.info(f"Gathering texts from {file}...")
-                    data = json.load(f)
                     for item in data:
                         key = item['KEY']
                         if key not in collected_data:
@@ -41,40 +72,154 @@ class TranslationManager:
                     self.logger.error(f"Failed to gather texts from {file}: {str(e)}")
         return collected_data
 
+    def _find_string_tables(self):
+        """Finds the string_table.json files, skipping the output directory,
+        the ignored paths and directories that never contain any."""
+        pruned = {Path(p) for p in self.config.ignored_paths}
+        pruned.add(Path(self.config.site_output_path))
+        pruned.add(self.config.CACHE_PATH)
+
+        for dirpath, dirnames, filenames in os.walk(self.config.ROOT_PATH):
+            dirnames[:] = [
+                d for d in dirnames
+                if d not in self.PRUNED_DIRS and Path(dirpath, d) not in pruned
+            ]
+            if 'string_table.json' in filenames:
+                yield Path(dirpath, 'string_table.json')
+
+    def _read_string_table(self, file):
+        self.logger.debug("Gathering texts from %s...", file)
+        try:
+            with open(file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            self.logger.error(f"Failed to gather texts from {file}: {str(e)}")
+            return None
+
     def _save_texts_to_po_files(self, collected_data):
         """Saves the gathered texts to .po files."""
         self.config.site_translation_path.mkdir(parents=True, exist_ok=True)
 
-        for lang in self.config.site_languages:
-            path = self.config.site_translation_path / f'texts_{lang}.po'
-            str_path = str(path).replace('\\', '/')
-            po = polib.pofile(str_path) if path.exists() else polib.POFile()
-
-            for id, text in collected_data.items():
-                if po.find(id) is None:
-                    entry = polib.POEntry(msgid=id, msgstr=text)
-                    po.append(entry)
-            try:
-                po.save(str_path)
-            except Exception as e:
-                raise IOError(f"Failed to save {path}: {str(e)}")
-
-    def _load_locale(self):
-        """Loads the locale data from .po files."""
-        for lang in self.config.site_languages:
-            path = self.config.site_translation_path / f'texts_{lang}.po'
-
-            if path.exists() is False:
-                self.locale[lang] = {}
-                continue
-
-            str_path = str(path).replace('\\', '/')
-            try:
-                po = polib.pofile(str_path)
-                self.locale[lang] = {entry.msgid: entry.msgstr for entry in po}
-            except Exception as e:
-                raise IOError(f"Failed to load {path}: {str(e)}")
-    
+        with ThreadPoolExecutor(max_workers=self.config.thread_count) as executor:
+            futures = [
+                executor.submit(self._save_texts_to_po_file, lang, collected_data)
+                for lang in self.config.site_languages
+            ]
+            for lang, future in zip(self.config.site_languages, futures):
+                if future.result():
+                    self.locale.pop(lang, None)
+
+    def _save_texts_to_po_file(self, lang, collected_data):
+        """Adds the missing texts to the .po file of a language, writing
+        it only if anything was added. Returns whether it was written."""
+        import polib
+
+        path = self.config.site_translation_path / f'texts_{lang}.po'
+        str_path = str(path).replace('\\', '/')
+        exists = path.exists()
+        po = polib.pofile(str_path) if exists else polib.POFile()
+
+        msgids = {entry.msgid for entry in po}
+        added = 0
+        for id, text in collected_data.items():
+            if id not in msgids:
+                entry = polib.POEntry(msgid=id, msgstr=text)
+                po.append(entry)
+                msgids.add(id)
+                added += 1
+
+        if exists and added == 0:
+            self.logger.info(f"No new texts for {path}.")
+            return False
+        try:
+            po.save(str_path)
+        except Exception as e:
+            raise IOError(f"Failed to save {path}: {str(e)}")
+        self.logger.info(f"Added {added} texts to {path}.")
+        return True
+
+    def reload_locale(self, lang):
+        """Reloads the locale data of a single language."""
+        self.logger.info(f"Reloading texts for language {lang}...")
+        self.locale[lang] = self._load_lang(lang)
+
+    def pop_load_time(self):
+        """Returns the wall and CPU time spent loading locale data since
+        the last call."""
+        load_time, self._load_time = self._load_time, [0.0, 0.0]
+        return load_time
+
+    def drop_outdated(self):
+        """Forgets the locale data of the languages whose .po file changed
+        since it was loaded, used by long running processes."""
+        for lang in list(self.locale):
+            if self._stamp(lang) != self._stamps.get(lang):
+                self.locale.pop(lang, None)
+
+    def _stamp(self, lang):
+        try:
+            stat = os.stat(self.config.site_translation_path / f'texts_{lang}.po')
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load_lang(self, lang):
+        """Loads the locale data of a language and measures how long it took."""
+        wall, cpu = perf_counter(), process_time()
+        # Taken first, so that a change made while loading is noticed
+        stamp = self._stamp(lang)
+        try:
+            table = self._parse_lang(lang)
+            self._stamps[lang] = stamp
+            return table
+        finally:
+            self._load_time[0] += perf_counter() - wall
+            self._load_time[1] += process_time() - cpu
+
+    def _parse_lang(self, lang):
+        """Loads the locale data of a language from the compiled catalog,
+        parsing its .po file only if the catalog is missing or outdated."""
+        path = self.config.site_translation_path / f'texts_{lang}.po'
+
+        try:
+            with open(path, 'rb') as f:
+                po_hash = hashlib.sha256(f.read())
+        except FileNotFoundError:
+            return {}
+        po_hash.update(f'{self.CATALOG_VERSION}'.encode('utf-8'))
+        catalog_path = self.config.CACHE_PATH / 'locale' / f'texts_{lang}.{po_hash.hexdigest()[:32]}.cache'
+
+        try:
+            with open(catalog_path, 'rb') as f:
+                return marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
+        # polib is only imported when a catalog has to be compiled
+        import polib
+
+        str_path = str(path).replace('\\', '/')
+        try:
+            po = polib.pofile(str_path)
+            table = {entry.msgid: entry.msgstr for entry in po}
+        except Exception as e:
+            raise IOError(f"Failed to load {path}: {str(e)}")
+        self._save_catalog(lang, catalog_path, table)
+        return table
+
+    def _save_catalog(self, lang, catalog_path, table):
+        """Compiles the locale data of a language, replacing its older catalogs."""
+        try:
+            catalog_path.parent.mkdir(parents=True, exist_ok=True)
+            for old_path in catalog_path.parent.glob(f'texts_{lang}.*.cache'):
+                old_path.unlink()
+            tmp_path = catalog_path.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp_path, 'wb') as f:
+                marshal.dump(table, f)
+            os.replace(tmp_path, catalog_path)
+        except OSError as e:
+            self.logger.warning(f"Failed to compile texts for language {lang}: {str(e)}")
+
     def get_text(self, key, lang):
         """Returns the text for the given key and language."""
         return self.locale[lang].get(key, key)
@@ -2,47 +2,153 @@ import os
 import time
 import logging
 import threading
-import http.server
-import socketserver
 from pathlib import Path
+from time import perf_counter
 
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler, PatternMatchingEventHandler
 
 from quickdot.core.generate import Generator
-
-
-def create_custom_handle(config):
-    class QuickdotHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
-        def translate_path(self, path):
-            path = path.lstrip('/')
-            return str(config.site_output_path / path)
-    return QuickdotHTTPRequestHandler
+from quickdot.core.server import PreviewServer
 
 
 class QuickdotHandler(PatternMatchingEventHandler):
-    def __init__(self, config, generator):
+    def __init__(self, config, generator, trans, on_rebuilt=None):
         # Normalize paths and ignore everything that is in the .git directory or in the output directory
         ignore_patterns = [os.path.normpath(str(p)) for p in config.ignored_paths]
         super().__init__(ignore_patterns=ignore_patterns)
         self.config = config
         self.generator = generator
+        self.trans = trans
+        # Called after every rebuild, returns the number of browsers notified
+        self.on_rebuilt = on_rebuilt
+
+        self._changed = set()
+        self._first_change = None
+        self._changed_lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._timer = None
 
     def on_modified(self, event):
+        self._on_changed(event.src_path)
+
+    def on_created(self, event):
+        self._on_changed(event.src_path)
+
+    def on_moved(self, event):
+        self._on_changed(event.src_path)
+        self._on_changed(event.dest_path)
+
+    def on_deleted(self, event):
+        self._on_changed(event.src_path)
+
+    def _on_changed(self, src_path):
+        path = Path(src_path)
         # Manual checking for windows since watchdog doesn't work properly there
-        if any(p in Path(event.src_path).parents for p in self.config.ignored_paths):
+        if any(p in path.parents for p in self.config.ignored_paths):
+            return
+        if any(f == path.name for f in self.config.ignored_files):
             return
-        if any(f == Path(event.src_path).name for f in self.config.ignored_files):
+        # Files written by the generator itself would cause infinite loops
+        if path == self.generator.manifest.path or self.config.CACHE_PATH in path.parents:
             return
         # We dont care about dir changes, cause they can cause
         # infinite loops
-        if Path(event.src_path).is_dir():
+        if path.is_dir():
             return
 
-        logging.info('File changed: %s', event.src_path)
-        logging.info('Rebuilding site...')
-        self.generator.regenerate()
-        logging.info(f'Rebuilding done ready @ http://localhost:{self.config.live_server_port}')
+        logging.info('File changed: %s', src_path)
+        # Coalesce bursts of events (editors writing several files,
+        # git checkouts) into a single rebuild
+        with self._changed_lock:
+            if not self._changed:
+                self._first_change = perf_counter()
+            self._changed.add(path)
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.config.watcher_debounce, self._rebuild)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _rebuild(self):
+        with self._build_lock:
+            with self._changed_lock:
+                changed, self._changed = self._changed, set()
+                first_change = self._first_change
+            if not changed:
+                return
+
+            logging.info('Rebuilding site...')
+            start = perf_counter()
+            try:
+                self._rebuild_paths(changed)
+            except Exception as e:
+                logging.error(f'Rebuilding failed: {e}')
+                return
+            rebuilt = perf_counter()
+            notified = self.on_rebuilt() if self.on_rebuilt is not None else 0
+            logging.info(
+                f'Rebuilding done in {(rebuilt - start) * 1000:.0f}ms, {notified} browsers notified '
+                f'{(perf_counter() - first_change) * 1000:.0f}ms after the first change, '
+                f'ready @ http://localhost:{self.config.live_server_port}'
+            )
+
+    def _rebuild_paths(self, paths):
+        """Does only the work affected by the given changed files."""
+        elements = set()
+        languages = set()
+        assets_changed = False
+        for path in sorted(paths):
+            kind, target = self._classify(path)
+            if kind == 'static':
+                # Pages link to the fingerprinted URLs of the assets
+                if self.generator.copy_static_file(path):
+                    assets_changed = True
+            elif kind == 'element':
+                elements.add(target)
+            elif kind == 'template':
+                users = self.generator.elements_using(path)
+                if users is None:
+                    self.generator.regenerate()
+                    return
+                elements.update(users)
+            elif kind == 'locale':
+                languages.add(target)
+            else:
+                self.generator.regenerate()
+                return
+
+        for lang in sorted(languages):
+            self.trans.reload_locale(lang)
+        if assets_changed:
+            self.generator.regenerate_elements()
+            return
+        if languages:
+            self.generator.regenerate_elements(languages=sorted(languages))
+        if elements:
+            self.generator.regenerate_elements(elements=elements)
+
+    def _classify(self, path):
+        """Maps a changed file to the part of the site it affects."""
+        root = self.config.ROOT_PATH
+        static_path = root / self.config.site_static_path
+        if static_path in path.parents:
+            return 'static', path
+        if self.config.site_translation_path in path.parents:
+            name = path.name
+            if name.startswith('texts_') and name.endswith('.po'):
+                lang = name[len('texts_'):-len('.po')]
+                if lang in self.config.site_languages:
+                    return 'locale', lang
+        try:
+            parts = path.relative_to(root).parts
+        except ValueError:
+            return 'site', None
+        if len(parts) >= 3 and parts[0] in ('pages', 'posts'):
+            return 'element', parts[1]
+        if len(parts) >= 2 and parts[0] == 'templates':
+            return 'template', path
+        return 'site', None
 
 
 class Watcher:
@@ -50,18 +156,19 @@ class Watcher:
         self.config = config
         self.generator = Generator(self.config, trans)
 
-        self.event_handler = QuickdotHandler(self.config, self.generator)
+        self.httpd = PreviewServer(self.config)
+        # Pages rendered by the watcher are served straight from memory
+        self.generator.writer.listeners.append(self.httpd.pages.update)
+
+        self.event_handler = QuickdotHandler(self.config, self.generator, trans, self.httpd.notify_reload)
 
         self.observer = Observer()
         self.observer.schedule(self.event_handler, path=self.config.ROOT_PATH, recursive=True)
 
-        Handler = create_custom_handle(self.config)
-        self.httpd = socketserver.TCPServer(("localhost", self.config.live_server_port), Handler)
-
     def watch(self):
         # Run the HTTP server in a separate daemon thread
         httpd_thread = threading.Thread(target=self.httpd.serve_forever)
-        httpd_thread.setDaemon(True)
+        httpd_thread.daemon = True
         httpd_thread.start()
         logging.info(f'Started HTTP server at http://localhost:{self.config.live_server_port}')
 
@@ -74,4 +181,5 @@ class Watcher:
         except KeyboardInterrupt:
             self.observer.stop()
         self.observer.join()
+        self.generator.close()
 
@@ -0,0 +1,29 @@
+import sys
+
+import pytest
+
+from quickdot.__main__ import parse_args
+from quickdot.core.config import Config
+
+
+@pytest.fixture
+def make_generator(tmp_path, monkeypatch):
+    """Returns a function creating a generator for the site written to
+    tmp_path, given the command line arguments of the build."""
+    from quickdot.core.trans import TranslationManager
+    from quickdot.core.generate import Generator
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Config, 'ROOT_PATH', tmp_path)
+    monkeypatch.setattr(Config, 'CACHE_PATH', tmp_path / '.quickdot')
+    generators = []
+
+    def make(*argv):
+        monkeypatch.setattr(sys, 'argv', ['quickdot', *argv])
+        config = Config(parse_args())
+        generators.append(Generator(config, TranslationManager(config)))
+        return generators[-1]
+
+    yield make
+    for generator in generators:
+        generator.close()
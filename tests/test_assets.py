@@ -0,0 +1,47 @@
+import json
+
+from quickdot.core.assets import minify_css, minify_html
+from test_generate import PAGES, write_site, build, set_text, read_pages
+
+
+def test_disabled_pipeline_removes_compressed_siblings(tmp_path):
+    """Servers serve the pre-compressed siblings in place of the files,
+    so none may outlive a build with the pipeline disabled."""
+    write_site(tmp_path, '<h1>{{ "X" | get_ttext }}</h1>{% block content %}{% endblock %}')
+    build(tmp_path, '--assets')
+    output = tmp_path / 'output'
+    assert (output / 'en' / 'pages' / 'page_0.html.gz').exists()
+
+    set_text(tmp_path, 'en', 'X', 'en edited')
+    site_config = json.loads((tmp_path / 'site.config.json').read_text(encoding='utf-8'))
+    site_config['site_pages'] = PAGES[:-1]
+    (tmp_path / 'site.config.json').write_text(json.dumps(site_config), encoding='utf-8')
+    build(tmp_path)
+    assert all('<h1>en edited</h1>' in page for page in read_pages(tmp_path, 'en', PAGES[:-1]))
+    assert not (output / 'en' / 'pages' / f'{PAGES[-1]}.html').exists()
+    assert list(output.rglob('*.gz')) == [] and list(output.rglob('*.br')) == []
+
+
+def test_minify_css_keeps_strings():
+    css = 'a  >  b { content : "a  ;  b" ; color : red ; }\n/* a comment */\n.x , .y { margin: 0 }'
+    minified = minify_css(css)
+    assert '"a  ;  b"' in minified
+    assert 'comment' not in minified
+    assert minified.startswith('a>b{content :"a  ;  b";color :red}')
+    assert minified.endswith('.x,.y{margin:0}')
+    assert minify_css("a::after { content: '/* not a comment */' }") == "a::after{content:'/* not a comment */'}"
+
+
+def test_minify_html_keeps_raw_text():
+    html = (
+        '<div>\n  <p>a   b</p>  <!-- a comment -->\n'
+        '<pre>  x\n    y </pre><textarea> a  b </textarea>'
+        '<style> a { color : red } </style><script> if (a  <  b) {} </script>'
+        '<!--[if IE]><p>old</p><![endif]--></div>'
+    )
+    assert minify_html(html) == (
+        '<div>\n<p>a b</p>\n'
+        '<pre>  x\n    y </pre><textarea> a  b </textarea>'
+        '<style>a{color :red}</style><script> if (a  <  b) {} </script>'
+        '<!--[if IE]><p>old</p><![endif]--></div>'
+    )
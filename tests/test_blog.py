@@ -0,0 +1,37 @@
+from quickdot.core.blog import PostIndex
+from quickdot.core.generate import PostElement
+
+
+def post(name, date, tags=()):
+    return PostElement(name, date, tuple(tags))
+
+
+def test_tags_with_the_same_slug_get_their_own_listing():
+    index = PostIndex([post('a', '2020-01-01', ['C++', 'c']), post('b', '2020-01-02', ['C#'])])
+    paths = [page.path for page in index.listing('en', 10)]
+    assert len(set(paths)) == len(paths) == 4
+    assert index.tag_url('en', 'c') == '/en/blog/tags/c/index.html'
+    assert index.slugs['C++'] != index.slugs['C#']
+    assert all(index.slugs[tag].startswith('c-') for tag in ('C++', 'C#'))
+
+
+def test_listing_pagination():
+    posts = [post(f'p{i}', f'2020-01-{i + 1:02}', ['odd'] if i % 2 else []) for i in range(7)]
+    pages = PostIndex(posts).listing('de', 3)
+
+    blog = [page for page in pages if page.tag is None]
+    assert [page.path for page in blog] == ['de/blog/index.html', 'de/blog/2.html', 'de/blog/3.html']
+    assert [[p.name for p in page.posts] for page in blog] == [['p6', 'p5', 'p4'], ['p3', 'p2', 'p1'], ['p0']]
+    assert [page.count for page in blog] == [3, 3, 3]
+    assert (blog[0].prev_url, blog[0].next_url) == (None, '/de/blog/2.html')
+    assert (blog[1].prev_url, blog[1].next_url) == ('/de/blog/index.html', '/de/blog/3.html')
+    assert blog[2].next_url is None
+
+    odd = [page for page in pages if page.tag == 'odd']
+    assert [page.path for page in odd] == ['de/blog/tags/odd/index.html']
+    assert [p.name for p in odd[0].posts] == ['p5', 'p3', 'p1']
+
+
+def test_empty_listing_has_one_page():
+    pages = PostIndex([]).listing('en', 10)
+    assert [(page.path, page.posts, page.count) for page in pages] == [('en/blog/index.html', [], 1)]
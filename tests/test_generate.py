@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import subprocess
+from pathlib import Path
+
+import pytest
+
+REPO_PATH = Path(__file__).resolve().parent.parent
+LANGUAGES = ['en', 'de']
+PAGES = [f'page_{i}' for i in range(12)]
+
+
+def write_site(path, base_template, templates=None):
+    """Writes a site whose pages all extend the given base template, with
+    the other given templates next to it."""
+    files = {
+        'config.json': json.dumps({
+            'use_threads': True,
+            'thread_count': 4,
+            'ignored_paths': ['output'],
+            'ignored_files': [],
+            'timezone': 'UTC',
+            'live_server_port': 8000,
+        }),
+        'site.config.json': json.dumps({
+            'site_name': 'Test',
+            'site_url': 'https://example.com',
+            'version': 1,
+            'site_description': 'A test site',
+            'site_author': 'QuickDot',
+            'site_keywords': 'test',
+            'site_author_email': 'test@example.com',
+            'site_index_page': PAGES[0],
+            'site_blog_page': PAGES[0],
+            'site_pages': PAGES,
+            'site_posts': [],
+            'site_static_path': 'static',
+            'site_output_path': 'output',
+            'site_languages': LANGUAGES,
+            'site_translation_path': 'translations',
+        }),
+        'templates/base.html': base_template,
+        **{f'templates/{name}': template for name, template in (templates or {}).items()},
+    }
+    for lang in LANGUAGES:
+        files[f'translations/texts_{lang}.po'] = f'#\nmsgid ""\nmsgstr ""\n\nmsgid "X"\nmsgstr "{lang} text"\n'
+        files[f'translations/texts_{lang}.po'] += ''.join(f'\nmsgid "Y{i}"\nmsgstr "{lang} unused {i}"\n' for i in range(50))
+    for page in PAGES:
+        files[f'pages/{page}/page.html'] = '{% extends "base.html" %}{% block content %}{{ _ELEMENT.name }}{% endblock %}'
+        files[f'pages/{page}/context.json'] = '{}'
+    files['static/site.css'] = 'body {}'
+    for relpath, content in files.items():
+        (path / relpath).parent.mkdir(parents=True, exist_ok=True)
+        (path / relpath).write_text(content, encoding='utf-8')
+
+
+def build(path, *args):
+    """Builds the site, returning the log."""
+    env = dict(os.environ, PYTHONPATH=str(REPO_PATH))
+    result = subprocess.run([sys.executable, '-m', 'quickdot', *args], cwd=path, env=env, check=True,
+                            capture_output=True, text=True)
+    return result.stderr
+
+
+def set_text(path, lang, key, text):
+    """Changes the translation of the key, adding it if it is missing."""
+    po_path = path / 'translations' / f'texts_{lang}.po'
+    po = po_path.read_text(encoding='utf-8')
+    entry = f'msgid "{key}"\nmsgstr "'
+    if entry in po:
+        start = po.index(entry) + len(entry)
+        po = po[:start] + text + po[po.index('"', start):]
+    else:
+        po += f'\n{entry}{text}"\n'
+    po_path.write_text(po, encoding='utf-8')
+
+
+def manifest_texts(path, key):
+    with open(path / '.buildmanifest', encoding='utf-8') as f:
+        return json.load(f)['outputs'][key]['texts']
+
+
+def read_pages(path, lang, pages=PAGES):
+    return [(path / 'output' / lang / 'pages' / f'{page}.html').read_text(encoding='utf-8') for page in pages]
+
+
+@pytest.mark.parametrize('args', [[], ['--dedup-languages'], ['--executor', 'process']])
+def test_translated_literal_in_base_template(tmp_path, args):
+    """The base template is compiled by whichever language renders first,
+    every language must still get its own translation."""
+    write_site(tmp_path, '<footer>{{ "X" | get_ttext }}</footer>{% block content %}{% endblock %}')
+    build(tmp_path, *args)
+    for lang in LANGUAGES:
+        for page in read_pages(tmp_path, lang):
+            assert f'<footer>{lang} text</footer>' in page
+
+
+def test_dedup_languages_encodes_real_language(tmp_path):
+    write_site(tmp_path, '<script>var l = {{ _LANG | tojson }};</script><a href="/{{ _LANG }}/">{% block content %}{% endblock %}</a>')
+    build(tmp_path, '--dedup-languages')
+    for lang in LANGUAGES:
+        for page in read_pages(tmp_path, lang):
+            assert f'var l = "{lang}";' in page
+            assert f'<a href="/{lang}/">' in page
+
+
+def test_include_in_loop_records_only_what_it_reads(tmp_path):
+    """Jinja copies the context for includes in loops, the copy must not
+    count as reading every translation."""
+    write_site(tmp_path, '{% for i in [1, 2] %}{% include "part.html" %}{% endfor %}{% block content %}{% endblock %}',
+               {'part.html': '<p>{{ X }}</p>'})
+    build(tmp_path)
+    assert manifest_texts(tmp_path, 'en/pages/page_0.html') == {'': ['X']}
+
+    set_text(tmp_path, 'en', 'Y0', 'en edited')
+    assert f'0 failed, {len(PAGES) * len(LANGUAGES)} up to date' in build(tmp_path)
+
+    set_text(tmp_path, 'en', 'X', 'en edited')
+    assert f'Rendered {len(PAGES)} of {len(PAGES)} outputs' in build(tmp_path)
+    assert all('<p>en edited</p><p>en edited</p>' in page for page in read_pages(tmp_path, 'en'))
+    assert all('<p>de text</p>' in page for page in read_pages(tmp_path, 'de'))
+
+
+def test_translation_added_later_is_rendered(tmp_path):
+    """Catalog entries are context variables, a page reading one that is
+    missing depends on it being added. Globals and site variables don't
+    count as missing translations."""
+    write_site(tmp_path, '<h1>{{ NEWKEY }}</h1>{{ static_url("site.css") }}{{ _CONFIG.site_name }}'
+                         '{% block content %}{% endblock %}')
+    build(tmp_path)
+    assert manifest_texts(tmp_path, 'de/pages/page_0.html') == {'': ['NEWKEY']}
+
+    set_text(tmp_path, 'de', 'NEWKEY', 'Neu')
+    assert f'Rendered {len(PAGES)} of {len(PAGES)} outputs' in build(tmp_path)
+    assert all('<h1>Neu</h1>' in page for page in read_pages(tmp_path, 'de'))
+    assert all('<h1></h1>' in page for page in read_pages(tmp_path, 'en'))
@@ -0,0 +1,58 @@
+from test_generate import LANGUAGES, PAGES, write_site, build, read_pages
+
+
+def test_output_reading_the_date_is_rendered_again_when_it_changes(tmp_path, make_generator):
+    write_site(tmp_path, '<footer>{{ _DATE }}</footer>{% block content %}{% endblock %}')
+    build(tmp_path)
+    generator = make_generator()
+    generator._gather_data()
+    assert generator.manifest.values('en/pages/page_0.html') == ['_DATE']
+    assert generator._plan_element('page_0', 'en', 'pages') is None
+
+    generator._values['en'] = dict(generator._language_values('en'), _DATE='the next day')
+    assert generator._plan_element('page_0', 'en', 'pages') is not None
+    assert generator._plan_element('page_0', 'de', 'pages') is None
+
+
+def test_manifest_freshness(tmp_path, make_generator):
+    write_site(tmp_path, '{% block content %}{% endblock %}')
+    manifest = make_generator().manifest
+    (tmp_path / 'input.txt').write_text('a', encoding='utf-8')
+    (tmp_path / 'output.txt').write_text('', encoding='utf-8')
+    digest = manifest.digest([tmp_path / 'input.txt'], 'extra')
+    manifest.record('output.txt', digest, [tmp_path / 'input.txt'], 0.5, {(None, 'X'), ('de', 'Y')}, ['_DATE'])
+
+    assert manifest.is_fresh('output.txt', digest, tmp_path / 'output.txt')
+    assert not manifest.is_fresh('output.txt', digest, tmp_path / 'missing.txt')
+    assert not manifest.is_fresh('output.txt', manifest.digest([tmp_path / 'input.txt'], 'other'))
+    assert sorted(manifest.texts('output.txt'), key=str) == [('de', 'Y'), (None, 'X')]
+    assert manifest.dependents(tmp_path / 'input.txt') == ['output.txt']
+
+    # File hashes are kept for the duration of a build
+    (tmp_path / 'input.txt').write_text('b', encoding='utf-8')
+    assert manifest.digest([tmp_path / 'input.txt'], 'extra') == digest
+    manifest.reset()
+    assert manifest.digest([tmp_path / 'input.txt'], 'extra') != digest
+
+    manifest.save()
+    manifest.load()
+    assert manifest.render_time('output.txt') == 0.5 and manifest.values('output.txt') == ['_DATE']
+    manifest.forget('output.txt')
+    assert manifest.texts('output.txt') is None and manifest.render_time('output.txt') == float('inf')
+
+
+def test_incremental_build_renders_only_what_changed(tmp_path):
+    write_site(tmp_path, '<h1>{{ title }}</h1>{% block content %}{% endblock %}')
+    outputs = len(PAGES) * len(LANGUAGES)
+    build(tmp_path)
+    assert f'0 failed, {outputs} up to date' in build(tmp_path)
+
+    (tmp_path / 'pages' / PAGES[1] / 'context.json').write_text('{"title": "Changed"}', encoding='utf-8')
+    (tmp_path / 'output' / 'de' / 'pages' / f'{PAGES[2]}.html').unlink()
+    assert f'Rendered 3 of 3 outputs (0 failed, {outputs - 3} up to date)' in build(tmp_path)
+    assert all('<h1>Changed</h1>' in read_pages(tmp_path, lang)[1] for lang in LANGUAGES)
+    assert (tmp_path / 'output' / 'de' / 'pages' / f'{PAGES[2]}.html').exists()
+
+    (tmp_path / 'templates' / 'base.html').write_text('<h2>{{ title }}</h2>{% block content %}{% endblock %}', encoding='utf-8')
+    assert f'Rendered {outputs} of {outputs} outputs' in build(tmp_path)
+    assert f'Rendered {outputs} of {outputs} outputs' in build(tmp_path, '--full-rebuild')
@@ -0,0 +1,52 @@
+import shutil
+import argparse
+
+import pytest
+
+from quickdot.__main__ import parse_shard
+from test_generate import LANGUAGES, PAGES, write_site, build
+
+
+@pytest.mark.parametrize('value, shard', [('1/1', (1, 1)), ('2/4', (2, 4)), ('4/4', (4, 4))])
+def test_parse_shard(value, shard):
+    assert parse_shard(value) == shard
+
+
+@pytest.mark.parametrize('value', ['0/4', '5/4', '1/0', '-1/2', '1', '1/2/3', 'a/b', ''])
+def test_parse_invalid_shard(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_shard(value)
+
+
+def test_every_render_belongs_to_one_shard(tmp_path, make_generator):
+    write_site(tmp_path, '{% block content %}{% endblock %}')
+    count = 3
+    generators = [make_generator('--shard', f'{index}/{count}') for index in range(1, count + 1)]
+    for lang in LANGUAGES:
+        for page in PAGES:
+            selected = [generator._selects_render(page, lang, 'pages') for generator in generators]
+            assert selected.count(True) == 1
+
+
+def read_output(path):
+    return {
+        file.relative_to(path).as_posix(): file.read_bytes()
+        for file in path.rglob('*') if file.is_file()
+    }
+
+
+def test_shards_add_up_to_a_full_build(tmp_path):
+    write_site(tmp_path / 'full', '<h1>{{ _ELEMENT.name }}</h1>{% block content %}{% endblock %}')
+    count = 3
+    for index in range(1, count + 1):
+        shutil.copytree(tmp_path / 'full', tmp_path / f'shard_{index}')
+    build(tmp_path / 'full')
+
+    merged = {}
+    for index in range(1, count + 1):
+        log = build(tmp_path / f'shard_{index}', '--shard', f'{index}/{count}')
+        assert 'Rendered 0 of 0' not in log
+        outputs = read_output(tmp_path / f'shard_{index}' / 'output')
+        assert not merged.keys() & outputs.keys()
+        merged.update(outputs)
+    assert merged == read_output(tmp_path / 'full' / 'output')
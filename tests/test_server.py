@@ -0,0 +1,53 @@
+import threading
+import http.client
+from types import SimpleNamespace
+
+import pytest
+
+from quickdot.core.server import PreviewServer
+
+DATA = bytes(range(100))
+
+
+@pytest.fixture(scope='module')
+def server(tmp_path_factory):
+    output_path = tmp_path_factory.mktemp('output')
+    (output_path / 'data.bin').write_bytes(DATA)
+    server = PreviewServer(SimpleNamespace(live_server_port=0, site_output_path=output_path))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get(server, headers):
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    try:
+        connection.request('GET', '/data.bin', headers=headers)
+        response = connection.getresponse()
+        return response.status, response.getheader('Content-Range'), response.read()
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize('range_header, status, content_range, body', [
+    (None, 200, None, DATA),
+    ('bytes=0-9', 206, 'bytes 0-9/100', DATA[:10]),
+    ('bytes=90-', 206, 'bytes 90-99/100', DATA[90:]),
+    ('bytes=-5', 206, 'bytes 95-99/100', DATA[95:]),
+    ('bytes=-500', 206, 'bytes 0-99/100', DATA),
+    ('bytes=95-200', 206, 'bytes 95-99/100', DATA[95:]),
+    ('bytes=100-', 416, 'bytes */100', b''),
+    ('bytes=10-5', 416, 'bytes */100', b''),
+    ('bytes=-', 416, 'bytes */100', b''),
+    ('bytes=0-1,5-6', 416, 'bytes */100', b''),
+    ('items=0-9', 416, 'bytes */100', b''),
+])
+def test_range_requests(server, range_header, status, content_range, body):
+    headers = {} if range_header is None else {'Range': range_header}
+    assert get(server, headers) == (status, content_range, body)
+
+
+def test_range_ignored_for_another_version(server):
+    assert get(server, {'Range': 'bytes=0-9', 'If-Range': '"stale"'}) == (200, None, DATA)